@@ -28,4 +28,6 @@ def get_client():
 client = Client()
 connection = client.redis()
 
-__all__ = ['connection_setup', 'get_client']
+from sessions import session, get_session
+
+__all__ = ['connection_setup', 'get_client', 'session', 'get_session']
@@ -16,7 +16,10 @@ class Container(object):
 
     When ``db`` is not set, the gets the default connection from
     ``redisco.connection`` module.
+
+    The batch operations send at most batch_size values per command.
     """
+    batch_size = 1000
 
     def __init__(self, key, db=None, pipeline=None):
         self._db = db
@@ -27,6 +30,25 @@ class Container(object):
         """Remove container from Redis database."""
         del self.db[self.key]
 
+    def _send_chunks(self, command, values, step=1):
+        """Sends the command with the values in chunks of batch_size
+        groups of step values.
+
+        Several chunks are sent in a single transaction unless the
+        container writes to a pipeline.
+        """
+        values = list(values)
+        if not values:
+            return
+        size = self.batch_size * step
+        db = self.db
+        if len(values) > size and self.pipeline is None:
+            db = db.pipeline()
+        for i in xrange(0, len(values), size):
+            db.execute_command(command, self.key, *values[i:i + size])
+        if db is not self.db:
+            db.execute()
+
     def __getattribute__(self, att):
         if att in object.__getattribute__(self, 'DELEGATEABLE_METHODS'):
             return partial(getattr(object.__getattribute__(self, 'db'), att), self.key)
@@ -36,9 +58,10 @@ class Container(object):
 
     @property
     def db(self):
-        if self.pipeline:
+        # an empty pipeline is false
+        if self.pipeline is not None:
             return self.pipeline
-        if self._db:
+        if self._db is not None:
             return self._db
         if hasattr(self, 'db_cache') and self.db_cache:
             return self.db_cache
@@ -53,9 +76,13 @@ class Container(object):
 class Set(Container):
     """A set stored in Redis."""
 
-    def add(self, value):
-        """Add the specified member to the Set."""
-        self.sadd(value)
+    def add(self, *values):
+        """Add the specified members to the Set."""
+        self._send_chunks('SADD', values)
+
+    def update_from(self, iterable):
+        """Add the members of the iterable to the Set."""
+        self._send_chunks('SADD', iterable)
 
     def remove(self, value):
         """Remove the value from the redis set."""
@@ -239,7 +266,7 @@ class List(Container):
 
     def extend(self, iterable):
         """Extend list by appending elements from the iterable."""
-        map(lambda i: self.rpush(i), iterable)
+        self._send_chunks('RPUSH', iterable)
 
     def count(self, value):
         """Return number of occurrences of value."""
@@ -268,6 +295,14 @@ class List(Container):
         """Add an element at the beginning of the list."""
         self.lpush(value)
 
+    def unshift_many(self, iterable):
+        """Add the elements of the iterable, in order, at the beginning
+        of the list.
+        """
+        values = list(iterable)
+        values.reverse()
+        self._send_chunks('LPUSH', values)
+
     def remove(self, value, num=1):
         """Remove first occurrence of value."""
         self.lrem(value, num)
@@ -321,7 +356,10 @@ class TypedList(object):
         target_type(string_val_of_list_elem, *type_args, **type_kwargs)
 
     target_type also accepts a string that refers to a redisco model.
+
+    Iterating over the list reads chunk_size items per LRANGE.
     """
+    chunk_size = 1000
 
     def __init__(self, key, target_type, type_args=[], type_kwargs={}, **kwargs):
         self.list = List(key, **kwargs)
@@ -348,7 +386,8 @@ class TypedList(object):
 
     def typecast_iter(self, values):
         if self._redisco_model:
-            return filter(lambda o: o is not None, [self.klass.objects.get_by_id(v) for v in values])
+            objects = self.klass.objects.in_bulk(set(values))
+            return [objects[v] for v in values if v in objects]
         else:
             return [self.klass(v, *self._klass_args, **self._klass_kwargs) for v in values]
 
@@ -382,8 +421,14 @@ class TypedList(object):
         self.list[index] = self.typecast_stor(value)
 
     def __iter__(self):
-        for i in xrange(len(self.list)):
-            yield self[i]
+        start = 0
+        while True:
+            values = self.list.lrange(start, start + self.chunk_size - 1)
+            for item in self.typecast_iter(values):
+                yield item
+            if len(values) < self.chunk_size:
+                break
+            start += self.chunk_size
 
     def __repr__(self):
         return repr(self.typecast_iter(self.list))
@@ -394,6 +439,13 @@ class SortedSet(Container):
         """Adds member to the set."""
         self.zadd(member, score)
 
+    def add_many(self, mapping):
+        """Adds the members of the mapping with their scores."""
+        args = []
+        for member, score in mapping.iteritems():
+            args.extend((score, member))
+        self._send_chunks('ZADD', args, 2)
+
     def remove(self, member):
         """Removes member from set."""
         self.zrem(member)
@@ -507,7 +559,7 @@ class SortedSet(Container):
 
     DELEGATEABLE_METHODS = ('zadd', 'zrem', 'zincrby', 'zrank',
             'zrevrank', 'zrange', 'zrevrange', 'zrangebyscore', 'zcard',
-            'zscore', 'zremrangebyrank', 'zremrangebyscore')
+            'zscore', 'zremrangebyrank', 'zremrangebyscore', 'zcount')
 
 
 class NonPersistentList(object):
@@ -551,6 +603,15 @@ class Hash(Container, collections.MutableMapping):
     def keys(self):
         return self.hkeys()
 
+    def update(self, *args, **kwargs):
+        """Sets the fields of a mapping or an iterable of (field, value)
+        pairs and of the keyword arguments with HMSET.
+        """
+        pairs = []
+        for field, value in dict(*args, **kwargs).iteritems():
+            pairs.extend((field, value))
+        self._send_chunks('HMSET', pairs, 2)
+
     def values(self):
         return self.hvals()
 
@@ -1,9 +1,11 @@
 from base import *
 from attributes import *
 from exceptions import *
+from cache import HashCache
 
 __all__ = ['Model', 'Attribute', 'BooleanField', 'IntegerField',
         'Counter', 'FloatField', 'DateTimeField', 'DateField',
         'ReferenceField', 'ListField', 'ValidationError', 'from_key',
         'ValidationError', 'MissingID', 'AttributeNotIndexed',
-        'FieldValidationError', 'BadKeyError']
+        'FieldValidationError', 'BadKeyError', 'ConflictError',
+        'HashCache']
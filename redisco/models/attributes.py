@@ -49,18 +49,24 @@ class Attribute(object):
             return getattr(instance, '_' + self.name)
         except AttributeError:
             if not instance.is_new():
-                val = instance.db.hget(instance.key(), self.name)
+                cache = instance._meta['cache']
+                h = cache.get(instance.key()) if cache is not None else None
+                if h is not None:
+                    val = h.get(self.name)
+                else:
+                    val = instance.db.hget(instance.key(), self.name)
                 if val is not None:
                     val = self.typecast_for_read(val)
-                self.__set__(instance, val)
+                setattr(instance, '_' + self.name, val)
                 return val
             else:
-                self.__set__(instance, self.default)
+                setattr(instance, '_' + self.name, self.default)
                 return self.default
 
 
     def __set__(self, instance, value):
         setattr(instance, '_' + self.name, value)
+        instance._mark_dirty(self.name)
 
     def typecast_for_read(self, value):
         """Typecasts the value for reading from Redis."""
@@ -105,8 +111,8 @@ class Attribute(object):
 
     def validate_uniqueness(self, instance, val):
         encoded = self.typecast_for_storage(val)
-        same = len(instance.__class__.objects.filter(**{self.name: encoded}))
-        if same > (0 if instance.is_new() else 1):
+        owner = instance.db.hget(instance._unique_key(self.name), encoded)
+        if owner is not None and (instance.is_new() or owner != instance.id):
             return (self.name, 'not unique',)
 
 
@@ -267,21 +273,72 @@ class ListField(object):
             return getattr(instance, '_' + self.name)
         except AttributeError:
             if instance.is_new():
-                val = self.default
+                val = list(self.default)
             else:
                 key = instance.key()[self.name]
                 val = List(key).members
+            stored = val
             if val is not None:
                 klass = self.value_type()
                 if self._redisco_model:
-                    val = filter(lambda o: o is not None, [klass.objects.get_by_id(v) for v in val])
+                    objects = klass.objects.in_bulk(set(val))
+                    val = [objects[v] for v in val if v in objects]
                 else:
                     val = [klass(v) for v in val]
-            self.__set__(instance, val)
+                    stored = self.typecast_for_storage(val)
+            setattr(instance, '_' + self.name, val)
+            if not instance.is_new():
+                # the ids as stored, with those of deleted objects, so
+                # that the commands of the changes match the list
+                instance._snapshot_list(self.name, stored)
             return val
 
     def __set__(self, instance, value):
         setattr(instance, '_' + self.name, value)
+        instance._mark_dirty(self.name)
+
+    def typecast_for_storage(self, value):
+        """Returns the list of the values to store in Redis."""
+        if not value:
+            return []
+        if self._redisco_model:
+            return [item.id for item in value]
+        return list(value)
+
+    def commands_for_storage(self, values, stored=None):
+        """Returns the commands, as (command, args...) tuples, that turn
+        the list stored as the values stored into values.
+
+        Appends are a single RPUSH, truncations an LTRIM, removals of
+        all the occurrences of some values LREMs and replacements
+        LSETs. Other changes rewrite the list, as does a stored of
+        None. An unchanged list needs no commands.
+        """
+        if stored is None:
+            return [('DEL',)] + self._rpush(values)
+        if values == stored:
+            return []
+        n = len(stored)
+        if values[:n] == stored:
+            return self._rpush(values[n:])
+        if not values:
+            return [('DEL',)]
+        if stored[:len(values)] == values:
+            return [('LTRIM', 0, len(values) - 1)]
+        if len(values) == n:
+            edits = [(i, v) for i, (v, old) in enumerate(zip(values, stored))
+                     if v != old]
+            if len(edits) <= n // 2:
+                return [('LSET', i, v) for i, v in edits]
+        removed = set(stored) - set(values)
+        if removed and [v for v in stored if v not in removed] == values:
+            return [('LREM', 0, v) for v in removed]
+        return [('DEL',)] + self._rpush(values)
+
+    def _rpush(self, values):
+        size = List.batch_size
+        return [('RPUSH',) + tuple(values[i:i + size])
+                for i in xrange(0, len(values), size)]
 
     def value_type(self):
         if isinstance(self._target_type, basestring):
@@ -1,12 +1,20 @@
+import os
+import math
 import time
+import uuid
+import random
+import threading
 from datetime import datetime, date
 import redisco
-from redisco.containers import Set, List, SortedSet, NonPersistentList
+from redisco.containers import Set, SortedSet, NonPersistentList
 from attributes import *
 from key import Key
 from managers import ManagerDescriptor, Manager
 from utils import _encode_key
-from exceptions import FieldValidationError, MissingID, BadKeyError
+from redis.exceptions import WatchError
+from exceptions import FieldValidationError, MissingID, BadKeyError, \
+        ConflictError
+import scripts
 
 __all__ = ['Model', 'from_key']
 
@@ -24,23 +32,32 @@ def _initialize_attributes(model_class, name, bases, attrs):
             model_class._attributes[k] = v
             v.name = v.name or k
 
+def _initialize_uniques(model_class, name, bases, attrs):
+    """Stores the list of the attributes with unique values."""
+    model_class._uniques = [k for k, v in model_class._attributes.iteritems()
+                            if v.unique]
+
 def _initialize_referenced(model_class, attribute):
     """Adds a property to the target of a reference field that
     returns the list of associated objects.
     """
-    # this should be a descriptor
-    def _related_objects(self):
-        return (model_class.objects
-                .filter(**{attribute.attname: self.id}))
-
     klass = attribute._target_type
     if isinstance(klass, basestring):
         return (klass, model_class, attribute)
-    else:
-        related_name = (attribute.related_name or
-                model_class.__name__.lower() + '_set')
-        setattr(klass, related_name,
-                property(_related_objects))
+    related_name = (attribute.related_name or
+            model_class.__name__.lower() + '_set')
+
+    # this should be a descriptor
+    def _related_objects(self):
+        try:
+            # set by ModelSet.prefetch_related
+            return getattr(self, '_' + related_name)
+        except AttributeError:
+            return (model_class.objects
+                    .filter(**{attribute.attname: self.id}))
+
+    setattr(klass, related_name, property(_related_objects))
+    klass._related_sets[related_name] = (model_class, attribute)
 
 def _initialize_lists(model_class, name, bases, attrs):
     """Stores the list fields descriptors of a model."""
@@ -84,11 +101,26 @@ def _initialize_counters(model_class, name, bases, attrs):
         if isinstance(v, Counter):
             model_class._counters.append(k)
 
+def _initialize_related_sets(model_class):
+    """Initializes the mapping of the names of the related sets
+    added by reference fields that target the model.
+    """
+    model_class._related_sets = {}
+
 def _initialize_key(model_class, name):
     """Initializes the key of the model."""
     model_class._key = Key(model_class._meta['key'] or name)
 
 
+def _initialize_id_allocator(model_class):
+    """Initializes the id block allocator of the model, if the
+    id_block_size option is set in Meta.
+    """
+    size = model_class._meta['id_block_size']
+    model_class._id_allocator = (IdAllocator(model_class._key['id'], size)
+                                 if size else None)
+
+
 def _initialize_manager(model_class):
     """Initializes the objects manager attribute of the model."""
     model_class.objects = ManagerDescriptor(Manager(model_class))
@@ -106,6 +138,26 @@ class ModelOptions(object):
                 indices = ('full_name',)
                 db = redis.Redis(host='localhost', port=29909)
 
+    Options
+        indices       -- names of methods or properties to index.
+        key           -- the prefix of the keys of the model.
+                         Default: the name of the class.
+        chunk_size    -- the number of instances loaded per pipeline.
+        cache         -- a HashCache of the hashes of the instances.
+        id_block_size -- reserve ids in blocks of this size instead
+                         of one INCR per new instance.
+        atomic_save   -- write with a single server-side script
+                         instead of taking a lock. Models with unique
+                         attributes are always written this way.
+        lock          -- a dict of the options of the Mutex taken
+                         when saving.
+        optimistic    -- keep a version in the hash and raise
+                         ConflictError when saving an instance changed
+                         since it was loaded, instead of taking a lock.
+        conflict_retries -- the number of times a save of an optimistic
+                         model is retried when its transaction is
+                         aborted but the version did not change.
+
     """
     def __init__(self, meta):
         self.meta = meta
@@ -129,13 +181,16 @@ class ModelBase(type):
         super(ModelBase, cls).__init__(name, bases, attrs)
         global _deferred_refs
         cls._meta = ModelOptions(attrs.pop('Meta', None))
+        _initialize_related_sets(cls)
         deferred = _initialize_references(cls, name, bases, attrs)
         _deferred_refs.extend(deferred)
         _initialize_attributes(cls, name, bases, attrs)
+        _initialize_uniques(cls, name, bases, attrs)
         _initialize_counters(cls, name, bases, attrs)
         _initialize_lists(cls, name, bases, attrs)
         _initialize_indices(cls, name, bases, attrs)
         _initialize_key(cls, name)
+        _initialize_id_allocator(cls)
         _initialize_manager(cls)
         # if targeted by a reference field using a string,
         # override for next try
@@ -198,8 +253,18 @@ class Model(object):
         _new = self.is_new()
         if _new:
             self._initialize_id()
-        with Mutex(self):
-            self._write(_new)
+        if self._writes_with_script() or self._meta['optimistic']:
+            written = self._write(_new)
+        else:
+            with Mutex(self, **(self._meta['lock'] or {})):
+                written = self._write(_new)
+        if not written:
+            if _new:
+                del self._id
+            return self._errors
+        session = redisco.get_session()
+        if session is not None:
+            session.add(self)
         return True
 
     def key(self, att=None):
@@ -211,11 +276,7 @@ class Model(object):
 
     def delete(self):
         """Deletes the object from the datastore."""
-        pipeline = self.db.pipeline()
-        self._delete_from_indices(pipeline)
-        self._delete_membership(pipeline)
-        pipeline.delete(self.key())
-        pipeline.execute()
+        self._delete_ids([self.id])
 
     def is_new(self):
         """Returns True if the instance is new.
@@ -323,8 +384,58 @@ class Model(object):
     @classmethod
     def exists(cls, id):
         """Checks if the model with id exists."""
-        return bool(redisco.get_client().exists(cls._key[str(id)]) or
-                    redisco.get_client().sismember(cls._key['all'], str(id)))
+        pipeline = redisco.get_client().pipeline(transaction=False)
+        pipeline.exists(cls._key[str(id)])
+        pipeline.sismember(cls._key['all'], str(id))
+        return any(pipeline.execute())
+
+    @classmethod
+    def _delete_ids(cls, ids):
+        """Deletes the objects with the ids, their lists and their
+        index entries with a single script, and returns the number of
+        objects deleted.
+        """
+        cache = cls._meta['cache']
+        changes = {'prefix': cls._key, 'ids': list(ids),
+                   'lists': list(cls._lists),
+                   'uniques': [(cls._key['_unique'][k], k)
+                               for k in cls._uniques],
+                   'channel': cache.channel if cache is not None else ''}
+        db = redisco.get_client()
+        deleted = scripts.run(db, scripts.DELETE, [cls._key['all']],
+                              [scripts.encode(changes)])
+        session = redisco.get_session()
+        for id in ids:
+            if cache is not None:
+                cache.invalidate(cls._key[id])
+            if session is not None:
+                session.discard(cls._key[id])
+        return deleted
+
+    @classmethod
+    def _claim_unique_values(cls, ids):
+        """Adds the values of the unique attributes of the objects with
+        the ids to the hashes of the unique values, and returns the
+        (id, attribute, value, owner) tuples of the values already held
+        by other objects.
+        """
+        if not cls._uniques or not ids:
+            return []
+        db = redisco.get_client()
+        pipeline = db.pipeline(transaction=False)
+        for id in ids:
+            pipeline.hmget(cls._key[id], cls._uniques)
+        claims = [(id, k, value)
+                  for id, values in zip(ids, pipeline.execute())
+                  for k, value in zip(cls._uniques, values)
+                  if value is not None]
+        for id, k, value in claims:
+            pipeline.hsetnx(cls._key['_unique'][k], value, id)
+            pipeline.hget(cls._key['_unique'][k], value)
+        owners = pipeline.execute()[1::2] if claims else []
+        return [(id, k, value, owner)
+                for (id, k, value), owner in zip(claims, owners)
+                if owner != id]
 
     ###################
     # Private methods #
@@ -332,19 +443,232 @@ class Model(object):
 
     def _initialize_id(self):
         """Initializes the id of the instance."""
-        self.id = str(self.db.incr(self._key['id']))
+        if self._id_allocator is not None:
+            self.id = self._id_allocator.next(self.db)
+        else:
+            self.id = str(self.db.incr(self._key['id']))
+
+    def _load_attributes(self, h, fields=None):
+        """Sets the attributes of the instance from the hash h as
+        returned by HGETALL.
+
+        Attributes missing from the hash are set to None so that
+        they are not fetched again. If fields is given, only those
+        attributes are set and the others are left to be fetched when
+        accessed. Counters are always read from the datastore.
+        """
+        for k, att in self.attributes.iteritems():
+            if isinstance(att, Counter):
+                continue
+            if fields is not None and k not in fields:
+                continue
+            val = h.get(att.name)
+            if val is not None:
+                val = att.typecast_for_read(val)
+            setattr(self, '_' + att.name, val)
+        version = scripts.VERSION
+        if self._meta['optimistic'] and (fields is None or version in h):
+            self.__dict__['_loaded_version'] = h.get(version) or '0'
 
     def _write(self, _new=False):
         """Writes the values of the attributes to the datastore.
 
         This method also creates the indices and saves the lists
-        associated to the object.
+        associated to the object. Returns False, with the errors set,
+        if a unique value was taken by another object in the meantime.
         """
-        pipeline = self.db.pipeline()
+        if self._writes_with_script():
+            if not self._write_with_script(_new):
+                return False
+        elif self._meta['optimistic']:
+            self._write_watched(_new)
+        else:
+            pipeline = self.db.pipeline()
+            self._queue_write(pipeline, _new)
+            pipeline.execute()
+        self._invalidate_cache()
+        self._mark_clean()
+        return True
+
+    def _writes_with_script(self):
+        """Returns True if the object is written by the save script:
+        when the atomic_save option is set, or the model has unique
+        attributes, whose values are claimed by the script.
+        """
+        return bool(self._meta['atomic_save'] or self._uniques)
+
+    def _queue_write(self, pipeline, _new=False):
+        """Queues the commands that write the object in pipeline.
+
+        New objects are written as a whole and have no indices to
+        remove, so nothing is read from the datastore for them. Saved
+        objects only write the attributes and lists changed since they
+        were loaded, and only move the index entries of those.
+        """
+        h, deleted, indices, lists, indexed, unindexed = \
+                self._pending_changes(_new)
         self._create_membership(pipeline)
-        self._update_indices(pipeline)
-        h = {}
-        # attributes
+        if _new:
+            pipeline.delete(self.key())
+        elif deleted:
+            pipeline.hdel(self.key(), *deleted)
+        if h:
+            pipeline.hmset(self.key(), h)
+
+        # indices
+        if not _new:
+            self._delete_from_indices(pipeline, indices)
+        for att in indices:
+            self._add_to_index(att, pipeline=pipeline)
+        for index in unindexed:
+            pipeline.srem(index, self.id)
+            pipeline.srem(self.key()['_indices'], index)
+        for index in indexed:
+            pipeline.sadd(index, self.id)
+            pipeline.sadd(self.key()['_indices'], index)
+
+        # lists
+        for k, commands in lists:
+            for command in commands:
+                pipeline.execute_command(command[0], self.key()[k],
+                                         *command[1:])
+        if not _new:
+            self._publish_invalidation(pipeline)
+
+    def _write_watched(self, _new=False):
+        """Writes the object in a transaction that watches its key.
+
+        Raises ConflictError if the version of the object is not the
+        one it was loaded with. Transactions aborted by other changes
+        of the hash, e.g. of a counter, are retried as many times as
+        the conflict_retries option allows.
+        """
+        expected = self.__dict__.get('_loaded_version')
+        retries = self._meta['conflict_retries'] or 0
+        while True:
+            pipeline = self.db.pipeline()
+            try:
+                version = '0'
+                if not _new:
+                    pipeline.watch(self.key())
+                    version = pipeline.hget(self.key(), scripts.VERSION) or '0'
+                    if expected is not None and version != expected:
+                        raise ConflictError("%s was changed by another "
+                                            "writer." % self.key())
+                pipeline.multi()
+                self._queue_write(pipeline, _new)
+                pipeline.hincrby(self.key(), scripts.VERSION, 1)
+                pipeline.execute()
+            except WatchError:
+                if retries <= 0:
+                    raise ConflictError("%s was changed by another "
+                                        "writer." % self.key())
+                retries -= 1
+                continue
+            finally:
+                pipeline.reset()
+            self.__dict__['_loaded_version'] = str(int(version) + 1)
+            return
+
+    def _write_with_script(self, _new=False):
+        """Writes the object with a single EVALSHA.
+
+        The script removes the old index entries of the changed
+        attributes, writes the hash, the new indices and the lists
+        atomically, so no lock is needed.
+        """
+        keys, changes = self._script_changes(_new)
+        version = scripts.run(self.db, scripts.SAVE, keys,
+                              [scripts.encode(changes)])
+        if version == scripts.UNIQUE_CONFLICT:
+            self._errors = self._unique_errors()
+            return False
+        if not version:
+            raise ConflictError("%s was changed by another writer."
+                                % self.key())
+        if changes['versioned']:
+            self.__dict__['_loaded_version'] = str(version)
+        return True
+
+    def _script_changes(self, _new=False, counters=True):
+        """Returns the keys and the changes passed to the save script.
+
+        If counters is False, the indices of the counters are left as
+        they are.
+        """
+        h, deleted, indices, lists, indexed, unindexed = \
+                self._pending_changes(_new, counters)
+        encode = self.db.connection_pool.get_encoder().encode
+        changes = {'id': self.id, 'new': _new, 'deleted': deleted,
+                   'hash': [], 'indices': [], 'zindices': [],
+                   'prefixes': [], 'zkeys': [], 'lists': [],
+                   'channel': '', 'existing': False,
+                   'versioned': bool(self._meta['optimistic']),
+                   'version': self.__dict__.get('_loaded_version') or ''}
+        for k, v in h.iteritems():
+            changes['hash'].extend((k, v))
+        changes['uniques'] = [(self._unique_key(k), k, h.get(k, ''))
+                              for k in self._uniques
+                              if k in h or k in deleted]
+        changes['claims'] = [(self._unique_key(k), k) for k in self._uniques
+                             if not _new and k not in h and k not in deleted]
+        for att in indices:
+            sets, zsets = self._index_entries(att)
+            changes['indices'].extend(sets)
+            changes['zindices'].extend(zsets)
+            if not _new:
+                changes['prefixes'].append(self._key[att] + ':')
+                changes['zkeys'].append(self._key[att])
+        changes['indices'].extend(indexed)
+        changes['unindexed'] = unindexed
+        for k, commands in lists:
+            commands = [[command[0]] + [encode(arg).decode('utf-8')
+                                        for arg in command[1:]]
+                        for command in commands]
+            changes['lists'].append((self.key()[k], commands))
+        cache = self._meta['cache']
+        if cache is not None and not _new:
+            changes['channel'] = cache.channel
+        keys = [self.key(), self.key()['_indices'],
+                self.key()['_zindices'], self._key['all']]
+        return keys, changes
+
+    def _pending_changes(self, _new=False, counters=True):
+        """Returns what save writes: the mapping of the fields of the
+        hash, the fields to remove from it, the indexed attributes to
+        update, the (name, commands) pairs of the lists and the keys
+        of the indices of list values to add and remove.
+
+        Lists loaded from the datastore are written with the commands
+        that apply the changes made since, and the indices of lists of
+        values other than models only move for the values added or
+        removed. Counters are changed by incr without being marked, so
+        their indices are always updated unless counters is False.
+        """
+        self._set_auto_now(_new)
+        changed = None if _new else self._changed_fields()
+        h, deleted = self._hash_for_storage(changed)
+        indices = [att for att in self.indices
+                   if changed is None or att in changed
+                   or (counters and att in self.counters)]
+        snapshots = {} if _new else self.__dict__.get('_list_snapshots', {})
+        lists, indexed, unindexed = [], [], []
+        for k, v in self.lists.iteritems():
+            if changed is not None and k not in changed:
+                continue
+            values = v.typecast_for_storage(getattr(self, k))
+            stored = snapshots.get(k)
+            lists.append((k, v.commands_for_storage(values, stored)))
+            if k in indices and stored is not None and not v._redisco_model:
+                indices.remove(k)
+                keys = set(self._index_key_for_attr_val(k, e) for e in values)
+                old = set(self._index_key_for_attr_val(k, e) for e in stored)
+                indexed.extend(keys - old)
+                unindexed.extend(old - keys)
+        return h, deleted, indices, lists, indexed, unindexed
+
+    def _set_auto_now(self, _new=False):
+        """Sets the values of the auto_now and auto_now_add fields."""
         for k, v in self.attributes.iteritems():
             if isinstance(v, DateTimeField):
                 if v.auto_now:
@@ -356,12 +680,29 @@ class Model(object):
                     setattr(self, k, date.today())
                 if v.auto_now_add and _new:
                     setattr(self, k, date.today())
+
+    def _hash_for_storage(self, changed=None):
+        """Returns the mapping of the fields of the hash to store and
+        the list of fields to remove from it.
+
+        If changed is given, only those attributes and the indices
+        defined in Meta are included.
+        """
+        h, deleted = {}, []
+        # attributes
+        for k, v in self.attributes.iteritems():
+            if changed is not None and k not in changed:
+                continue
             for_storage = getattr(self, k)
             if for_storage is not None:
                 h[k] = v.typecast_for_storage(for_storage)
+            else:
+                deleted.append(k)
         # indices
         for index in self.indices:
             if index not in self.lists and index not in self.attributes:
+                if changed is not None and index not in changed:
+                    continue
                 v = getattr(self, index)
                 if callable(v):
                     v = v()
@@ -370,21 +711,95 @@ class Model(object):
                         h[index] = unicode(v)
                     except UnicodeError:
                         h[index] = unicode(v.decode('utf-8'))
-        pipeline.delete(self.key())
-        if h:
-            pipeline.hmset(self.key(), h)
+                else:
+                    deleted.append(index)
+        return h, deleted
 
-        # lists
+    ##########
+    # Unique #
+    ##########
+
+    def _unique_key(self, att):
+        """Returns the key of the hash of the values of the unique
+        attribute att and the ids of the objects that hold them.
+        """
+        return self._key['_unique'][att]
+
+    def _unique_errors(self):
+        """Returns the errors of the unique attributes whose values
+        are held by other objects.
+        """
+        atts = [(k, self.attributes[k]) for k in self._uniques
+                if getattr(self, k)]
+        pipeline = self.db.pipeline(transaction=False)
+        for k, att in atts:
+            pipeline.hget(self._unique_key(k),
+                          att.typecast_for_storage(getattr(self, k)))
+        owners = pipeline.execute() if atts else []
+        id = getattr(self, '_id', None)
+        return [(k, 'not unique') for (k, att), owner in zip(atts, owners)
+                if owner is not None and owner != id]
+
+    ################
+    # Dirty fields #
+    ################
+
+    def _mark_dirty(self, att):
+        """Marks the attribute or list att as changed."""
+        self.__dict__.setdefault('_dirty', set()).add(att)
+
+    def _snapshot_list(self, att, stored):
+        """Keeps the values of the list att as stored in the datastore,
+        to tell whether it was changed.
+        """
+        snapshots = self.__dict__.setdefault('_list_snapshots', {})
+        snapshots[att] = stored
+
+    def _changed_fields(self):
+        """Returns the set of the names of the attributes and lists
+        changed since the object was loaded or saved.
+
+        Lists are compared with the values they were loaded with, so
+        changes made in place are found too. The indices defined in
+        Meta are included when any attribute was changed.
+        """
+        changed = set(self.__dict__.get('_dirty', ()))
+        snapshots = self.__dict__.get('_list_snapshots', {})
         for k, v in self.lists.iteritems():
-            l = List(self.key()[k], pipeline=pipeline)
-            l.clear()
-            values = getattr(self, k)
-            if values:
-                if v._redisco_model:
-                    l.extend([item.id for item in values])
-                else:
-                    l.extend(values)
-        pipeline.execute()
+            if k in snapshots and hasattr(self, '_' + v.name):
+                values = v.typecast_for_storage(getattr(self, k))
+                if values != snapshots[k]:
+                    changed.add(k)
+        if changed & set(self.attributes):
+            changed.update(index for index in self.indices
+                           if index not in self.attributes
+                           and index not in self.lists)
+        return changed
+
+    def _mark_clean(self):
+        """Forgets the changes after the object was written."""
+        self.__dict__.pop('_dirty', None)
+        for k, v in self.lists.iteritems():
+            if hasattr(self, '_' + v.name):
+                self._snapshot_list(k, v.typecast_for_storage(getattr(self, k)))
+
+    #########
+    # Cache #
+    #########
+
+    def _publish_invalidation(self, pipeline):
+        """Publishes the key of the object on the channel of the
+        cache of the model, if any.
+        """
+        cache = self._meta['cache']
+        if cache is not None:
+            pipeline.publish(cache.channel, self.key())
+
+    def _invalidate_cache(self):
+        """Removes the hash of the object from the cache of the model."""
+        cache = self._meta['cache']
+        if cache is not None:
+            cache.invalidate(self.key())
 
     ##############
     # Membership #
@@ -396,66 +811,77 @@ class Model(object):
         """
         Set(self._key['all'], pipeline=pipeline).add(self.id)
 
-    def _delete_membership(self, pipeline=None):
-        """Removes the id of the object to the set of all objects of the
-        same class.
-        """
-        Set(self._key['all'], pipeline=pipeline).remove(self.id)
-
 
     ############
     # INDICES! #
     ############
 
-    def _update_indices(self, pipeline=None):
-        """Updates the indices of the object."""
-        self._delete_from_indices(pipeline)
-        self._add_to_indices(pipeline)
-
-    def _add_to_indices(self, pipeline):
-        """Adds the base64 encoded values of the indices."""
-        for att in self.indices:
-            self._add_to_index(att, pipeline=pipeline)
-
     def _add_to_index(self, att, val=None, pipeline=None):
         """
         Adds the id to the index.
 
         This also adds to the _indices set of the object.
         """
+        indices, zindices = self._index_entries(att)
+        for index in indices:
+            pipeline.sadd(index, self.id)
+            pipeline.sadd(self.key()['_indices'], index)
+        for zindex, score in zindices:
+            pipeline.zadd(zindex, self.id, score)
+            pipeline.sadd(self.key()['_zindices'], zindex)
+
+    def _index_entries(self, att):
+        """Returns the keys of the sets the id is added to for the
+        attribute att and the (key, score) pairs of the sorted sets.
+        """
         index = self._index_key_for(att)
         if index is None:
-            return
+            return [], []
         t, index = index
         if t == 'attribute':
-            pipeline.sadd(index, self.id)
-            pipeline.sadd(self.key()['_indices'], index)
+            return [index], []
         elif t == 'list':
-            for i in index:
-                pipeline.sadd(i, self.id)
-                pipeline.sadd(self.key()['_indices'], i)
+            return index, []
         elif t == 'sortedset':
             zindex, index = index
-            pipeline.sadd(index, self.id)
-            pipeline.sadd(self.key()['_indices'], index)
             descriptor = self.attributes[att]
             score = descriptor.typecast_for_storage(getattr(self, att))
-            pipeline.zadd(zindex, self.id, score)
-            pipeline.sadd(self.key()['_zindices'], zindex)
+            return [index], [(zindex, score)]
+        return [], []
 
 
-    def _delete_from_indices(self, pipeline):
+    def _delete_from_indices(self, pipeline, atts=None):
         """Deletes the object's id from the sets(indices) it has been added
         to and removes its list of indices (used for housekeeping).
+
+        If atts is given, only the indices of those attributes are
+        removed.
         """
+        if atts is not None and not atts:
+            return
         s = Set(self.key()['_indices'])
         z = Set(self.key()['_zindices'])
-        for index in s.members:
+        reads = self.db.pipeline(transaction=False)
+        reads.smembers(s.key)
+        reads.smembers(z.key)
+        indices, zindices = reads.execute()
+        if atts is not None:
+            prefixes = tuple(self._key[att] + ':' for att in atts)
+            zkeys = set(self._key[att] for att in atts)
+            indices = [i for i in indices if i.startswith(prefixes)]
+            zindices = [i for i in zindices if i in zkeys]
+        for index in indices:
             pipeline.srem(index, self.id)
-        for index in z.members:
+        for index in zindices:
             pipeline.zrem(index, self.id)
-        pipeline.delete(s.key)
-        pipeline.delete(z.key)
+        if atts is None:
+            pipeline.delete(s.key)
+            pipeline.delete(z.key)
+        else:
+            if indices:
+                pipeline.srem(s.key, *indices)
+            if zindices:
+                pipeline.srem(z.key, *zindices)
 
     def _index_key_for(self, att, value=None):
         """Returns a key based on the attribute and its value.
@@ -546,13 +972,74 @@ def from_key(key):
     return model.objects.get_by_id(id)
 
 
+class IdAllocator(object):
+    """Hands out the ids of a model from blocks of size ids reserved
+    with a single INCRBY.
+
+    Blocks are reserved atomically so processes never share ids, but
+    ids are no longer assigned in creation order across processes and
+    the unused ids of a block are lost when the process exits. A
+    forked process drops the block inherited from its parent.
+    """
+    def __init__(self, key, size):
+        self.key = key
+        self.size = size
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._next = 1
+        self._last = 0
+
+    def next(self, db):
+        """Returns the next id, reserving a new block if needed."""
+        if self._pid != os.getpid():
+            self._reset()
+        with self._lock:
+            if self._next > self._last:
+                self._last = db.incr(self.key, self.size)
+                self._next = self._last - self.size + 1
+            id = self._next
+            self._next += 1
+            return id
+
+
 class Mutex(object):
     """Implements locking so that other instances may not modify it.
 
-    Code ported from Ohm.
+    The lock is a key set with SET NX PX to a random token, so it
+    expires by itself if its holder dies and is only deleted by its
+    holder. Contenders retry after an exponential backoff with jitter
+    or, if blocking is set, wait on a list that is pushed to when the
+    lock is released while they wait.
+
+    Options
+        timeout     -- milliseconds after which the lock expires.
+                       Default: 1000.
+        backoff     -- seconds to wait before the first retry; doubled
+                       after every retry. Default: 0.01.
+        max_backoff -- maximum seconds to wait between retries.
+                       Default: 0.5.
+        blocking    -- block with BLPOP until the lock is released
+                       instead of polling. Default: False.
+
+    The defaults can be changed with the lock option of the Meta class
+    of the model, e.g. lock = {'blocking': True}.
     """
-    def __init__(self, instance):
+    options = ('timeout', 'backoff', 'max_backoff', 'blocking')
+    timeout = 1000
+    backoff = 0.01
+    max_backoff = 0.5
+    blocking = False
+
+    def __init__(self, instance, **options):
         self.instance = instance
+        for k, v in options.iteritems():
+            if k not in Mutex.options:
+                raise ValueError("Unknown lock option %s." % k)
+            setattr(self, k, v)
+        self.token = None
 
     def __enter__(self):
         self.lock()
@@ -561,27 +1048,49 @@ class Mutex(object):
     def __exit__(self, exc_type, exc_value, traceback):
         self.unlock()
 
-    def lock(self):
-        o = self.instance
-        while not o.db.setnx(o.key('_lock'), self.lock_timeout):
-            lock = o.db.get(o.key('_lock'))
-            if not lock:
-                continue
-            if not self.lock_has_expired(lock):
-                time.sleep(0.5)
-                continue
-            lock = o.db.getset(o.key('_lock'), self.lock_timeout)
-            if not lock:
-                break
-            if self.lock_has_expired(lock):
-                break
+    @property
+    def key(self):
+        return self.instance.key('_lock')
 
-    def lock_has_expired(self, lock):
-        return float(lock) < time.time()
+    @property
+    def signal_key(self):
+        return self.instance.key('_unlocked')
 
-    def unlock(self):
-        self.instance.db.delete(self.instance.key('_lock'))
+    def lock(self):
+        db = self.instance.db
+        token = uuid.uuid4().hex
+        backoff = self.backoff
+        while not db.set(self.key, token, px=self.timeout, nx=True):
+            if self.blocking:
+                self._wait(db)
+            else:
+                time.sleep(random.uniform(backoff / 2, backoff))
+                backoff = min(backoff * 2, self.max_backoff)
+        self.token = token
 
     @property
-    def lock_timeout(self):
-        return "%f" % (time.time() + 1.0)
+    def waiting_key(self):
+        return self.instance.key('_waiting')
+
+    def _wait(self, db):
+        """Blocks until the lock is released or expires.
+
+        The waiting key is set before the expiry of the lock is read,
+        so a lock released in between is either seen as released or
+        signals the waiter.
+        """
+        pipeline = db.pipeline(transaction=False)
+        pipeline.set(self.waiting_key, 1, px=self.timeout)
+        pipeline.pttl(self.key)
+        ttl = pipeline.execute()[-1]
+        if ttl > 0:
+            db.blpop(self.signal_key, int(math.ceil(ttl / 1000.0)))
+
+    def unlock(self):
+        """Releases the lock if it is still held by this mutex."""
+        if self.token is None:
+            return
+        scripts.run(self.instance.db, scripts.UNLOCK,
+                    [self.key, self.signal_key, self.waiting_key],
+                    [self.token, self.timeout])
+        self.token = None
@@ -0,0 +1,96 @@
+"""
+Process-local cache of the hashes of the model instances.
+"""
+import time
+import threading
+from collections import OrderedDict
+import redisco
+
+CHANNEL = 'redisco:invalidate'
+
+
+class HashCache(object):
+    """A least recently used cache of model hashes.
+
+    Set an instance as the cache option in the Meta class of a model
+    to make get_by_id, queries and attribute reads use the cached
+    hashes. Saving or deleting an instance invalidates its entry and
+    publishes its key on the channel so that other processes that
+    called listen can invalidate theirs.
+
+    Example:
+
+        class Country(models.Model):
+            name = models.Attribute()
+
+            class Meta:
+                cache = HashCache(size=500, ttl=300)
+
+    Options
+        size    -- maximum number of hashes kept. Default: 1000.
+        ttl     -- seconds after which a hash is fetched again.
+                   Default: 60.
+        channel -- the pub/sub channel of the invalidations.
+
+    """
+    def __init__(self, size=1000, ttl=60, channel=CHANNEL):
+        self.size = size
+        self.ttl = ttl
+        self.channel = channel
+        self.hits = 0
+        self.misses = 0
+        self._hashes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the cached hash of key, or None."""
+        with self._lock:
+            try:
+                expires, h = self._hashes.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            if expires < time.time():
+                self.misses += 1
+                return None
+            self._hashes[key] = (expires, h)
+            self.hits += 1
+            return h
+
+    def set(self, key, h):
+        """Caches the hash h of key."""
+        with self._lock:
+            self._hashes.pop(key, None)
+            self._hashes[key] = (time.time() + self.ttl, h)
+            while len(self._hashes) > self.size:
+                self._hashes.popitem(last=False)
+
+    def invalidate(self, key):
+        """Removes the hash of key from the cache."""
+        with self._lock:
+            self._hashes.pop(key, None)
+
+    def clear(self):
+        """Removes all the hashes from the cache."""
+        with self._lock:
+            self._hashes.clear()
+
+    def listen(self, db=None):
+        """Starts a daemon thread that invalidates the keys published
+        on the channel by other processes. Returns the thread.
+        """
+        pubsub = (db or redisco.get_client()).pubsub()
+        pubsub.subscribe(self.channel)
+
+        def run():
+            for message in pubsub.listen():
+                if message['type'] == 'message':
+                    self.invalidate(message['data'])
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def __len__(self):
+        return len(self._hashes)
@@ -27,6 +27,28 @@ class Manager(object):
     def create(self, **kwargs):
         return self.get_model_set().create(**kwargs)
 
+    def bulk_create(self, instances, batch_size=None):
+        return self.get_model_set().bulk_create(instances, batch_size)
+
+    def update(self, **kwargs):
+        return self.get_model_set().update(**kwargs)
+
+    def truncate(self):
+        """Deletes all the objects of the model."""
+        return self.get_model_set().delete()
+
+    def rebuild_unique_index(self):
+        """Adds the values of the unique attributes of all the objects
+        to the hashes of the unique values, e.g. after an attribute was
+        made unique, and returns the (id, attribute, value, owner)
+        tuples of the values held by more than one object.
+        """
+        s = self.get_model_set()
+        clashes = []
+        for ids in s._iter_ids(s._chunk_size):
+            clashes.extend(self.model_class._claim_unique_values(ids))
+        return clashes
+
     def get_or_create(self, **kwargs):
         return self.get_model_set().get_or_create(**kwargs)
 
@@ -39,10 +61,31 @@ class Manager(object):
     def get_by_id(self, id):
         return self.get_model_set().get_by_id(id)
 
+    def in_bulk(self, ids, fields=None):
+        return self.get_model_set().in_bulk(ids, fields)
+
     def order(self, field):
         return self.get_model_set().order(field)
 
     def zfilter(self, **kwargs):
         return self.get_model_set().zfilter(**kwargs)
 
+    def only(self, *fields):
+        return self.get_model_set().only(*fields)
+
+    def defer(self, *fields):
+        return self.get_model_set().defer(*fields)
+
+    def select_related(self, *fields):
+        return self.get_model_set().select_related(*fields)
+
+    def prefetch_related(self, *names):
+        return self.get_model_set().prefetch_related(*names)
+
+    def values(self, *fields):
+        return self.get_model_set().values(*fields)
+
+    def values_list(self, *fields, **kwargs):
+        return self.get_model_set().values_list(*fields, **kwargs)
+
 
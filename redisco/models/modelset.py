@@ -7,6 +7,10 @@ from redisco.containers import SortedSet, Set, List, NonPersistentList
 from exceptions import AttributeNotIndexed
 from utils import _encode_key
 from attributes import ZINDEXABLE
+import scripts
+
+# Number of hashes fetched per pipeline when loading instances.
+CHUNK_SIZE = 1000
 
 # Model Set
 class ModelSet(Set):
@@ -20,6 +24,11 @@ class ModelSet(Set):
         self._ordering = []
         self._limit = None
         self._offset = None
+        self._chunk_size = model_class._meta['chunk_size'] or CHUNK_SIZE
+        self._only = None
+        self._deferred = ()
+        self._related = ()
+        self._prefetch = ()
 
     #################
     # MAGIC METHODS #
@@ -27,48 +36,164 @@ class ModelSet(Set):
 
 
     def __getitem__(self, index):
+        # Unless the set has been evaluated, the slice is turned into
+        # the limit and offset of the query.
+        evaluated = hasattr(self, '_cached_set')
         if isinstance(index, slice):
-            return map(lambda id: self._get_item_with_id(id), self._set[index])
+            if not evaluated and index.step in (None, 1):
+                model_set = self._sliced(index.start or 0, index.stop)
+                if model_set is not None:
+                    return list(model_set._iter_items(model_set._set))
+            return list(self._iter_items(self._set[index]))
         else:
-            id = self._set[index]
-            if id:
-                return self._get_item_with_id(id)
+            if not evaluated and index >= 0:
+                ids = self._sliced(index, index + 1)._set
+                if not ids:
+                    raise IndexError
+                id = ids[0]
             else:
-                raise IndexError
+                id = self._set[index]
+            return self._get_items_with_ids([id])[0]
 
     def __repr__(self):
-        if len(self._set) > 30:
-            m = self._set[:30]
-        else:
-            m = self._set
-        s = map(lambda id: self._get_item_with_id(id), m)
-        return "%s" % s
+        return "%s" % self[:30]
 
     def __iter__(self):
-        for id in self._set:
-            yield self._get_item_with_id(id)
+        return self._iter_items(self._set)
 
     def __len__(self):
-        return len(self._set)
+        if hasattr(self, '_cached_set'):
+            return len(self._cached_set)
+        return self.count()
 
     def __contains__(self, val):
-        return val.id in self._set
+        if not isinstance(val, self.model_class):
+            return False
+        if hasattr(self, '_cached_set') or self._limit is not None:
+            return val.id in self._set
+        # Checks the membership of the id in each index of the
+        # filters instead of fetching the ids of the set.
+        if self._zfilters:
+            zset, min, max = self._zfilter_range()
+            score = zset.zscore(val.id)
+            return score is not None and _in_range(score, min, max)
+        pipeline = self.db.pipeline(transaction=False)
+        pipeline.sismember(self.key, val.id)
+        filters = self._index_keys(self._filters)
+        exclusions = self._index_keys(self._exclusions)
+        for index in filters + exclusions:
+            pipeline.sismember(index, val.id)
+        replies = pipeline.execute()
+        return (all(replies[:len(filters) + 1]) and
+                not any(replies[len(filters) + 1:]))
 
     ##########################################
     # METHODS THAT RETURN A SET OF INSTANCES #
     ##########################################
 
     def get_by_id(self, id):
-        if self.model_class.exists(id):
-            return self._get_item_with_id(id)
+        """Returns the loaded instance with the id, or None if it does
+        not exist.
+
+        Existence is checked and the hash fetched in one pipeline.
+        """
+        return self._get_items_with_ids([str(id)], existing_only=True)[0]
+
+    def count(self):
+        """Returns the number of instances in the set.
+
+        The ids are neither sorted nor fetched: the cardinality of the
+        filtered set is read with SCARD, or ZCOUNT for zfilters.
+        """
+        if hasattr(self, '_cached_set'):
+            return len(self._cached_set)
+        if self._zfilters:
+            zset, low, high = self._zfilter_range()
+            n = zset.zcount(low, high)
+        elif not self._filters and not self._exclusions:
+            n = self.db.scard(self.key)
+        else:
+            pipeline = self.db.pipeline(transaction=False)
+            s = self._filtered_set(pipeline)
+            pipeline.scard(s.key)
+            n = pipeline.execute()[-1]
+            self._delete_temporary_keys()
+        limit, offset = self._get_limit_and_offset()
+        n = max(0, n - (offset or 0))
+        if limit is not None:
+            n = min(n, limit)
+        return n
+
+    def iterator(self, chunk_size=None):
+        """Iterates over the instances without fetching all the ids of
+        the set at once.
+
+        The ids are read and the instances loaded chunk_size at a
+        time. Without an ordering or a limit, the ids are scanned with
+        SSCAN and come in no particular order, and an object may be
+        yielded more than once if the set changes during the scan;
+        otherwise the sorted ids stored in Redis are read with one
+        LRANGE per chunk.
+        """
+        for ids in self._iter_ids(chunk_size or self._chunk_size):
+            for instance in self._get_items_with_ids(ids):
+                yield instance
+
+    def in_bulk(self, ids, fields=None):
+        """Returns a dict that maps the ids of the objects that exist,
+        as they were given, to their instances.
+
+        The ids are checked for membership and the hashes fetched one
+        pipeline per chunk of ids. If fields is given, only those
+        attributes are loaded.
+        """
+        model_set = self if fields is None else self.only(*fields)
+        ids = list(ids)
+        items = {}
+        for i in xrange(0, len(ids), self._chunk_size):
+            chunk = ids[i:i + self._chunk_size]
+            instances = model_set._get_items_with_ids(
+                    [str(id) for id in chunk], existing_only=True)
+            for id, instance in zip(chunk, instances):
+                if instance is not None:
+                    items[id] = instance
+        return items
 
     def first(self):
         try:
-            return self.limit(1).__getitem__(0)
+            return self[0]
         except IndexError:
             return None
 
 
+    def values(self, *fields):
+        """Returns an iterator over dicts that map the given attributes
+        (all of them and the id by default) to their values.
+
+        The values are read and typecasted without instantiating the
+        model.
+        """
+        fields = self._values_fields(fields)
+        return (dict(zip(fields, row)) for row in self._iter_rows(fields))
+
+    def values_list(self, *fields, **kwargs):
+        """Returns an iterator over tuples of the values of the given
+        attributes (all of them and the id by default).
+
+        If flat is True and a single field is given, the values
+        themselves are returned instead of 1-tuples.
+        """
+        flat = kwargs.pop('flat', False)
+        if kwargs:
+            raise TypeError("Unexpected keyword arguments to values_list: %s"
+                    % kwargs.keys())
+        if flat and len(fields) != 1:
+            raise TypeError("flat is only valid with a single field.")
+        fields = self._values_fields(fields)
+        if flat:
+            return (row[0] for row in self._iter_rows(fields))
+        return (tuple(row) for row in self._iter_rows(fields))
+
     #####################################
     # METHODS THAT MODIFY THE MODEL SET #
     #####################################
@@ -115,6 +240,60 @@ class ModelSet(Set):
         clone._offset = offset
         return clone
 
+    def only(self, *fields):
+        """Loads only the given attributes of the instances.
+
+        The other attributes are fetched when accessed.
+        """
+        self._check_fields(fields)
+        clone = self._clone()
+        clone._only = fields
+        clone._deferred = ()
+        return clone
+
+    def defer(self, *fields):
+        """Does not load the given attributes until they are accessed."""
+        self._check_fields(fields)
+        clone = self._clone()
+        clone._deferred = clone._deferred + fields
+        return clone
+
+    def select_related(self, *fields):
+        """Loads the objects referenced by the given reference fields
+        together with the instances.
+
+        The referenced objects of each chunk of instances are fetched
+        in a single pipeline.
+        """
+        for k in fields:
+            if k not in self.model_class._references:
+                raise ValueError("%s is not a reference field of %s." %
+                        (k, self.model_class.__name__))
+        clone = self._clone()
+        clone._related = clone._related + fields
+        return clone
+
+    def prefetch_related(self, *names):
+        """Loads the related sets of the given names together with the
+        instances.
+
+        The related objects of each chunk of instances are looked up
+        in a single pipeline and cached on the instances.
+        """
+        for k in names:
+            if k not in self.model_class._related_sets:
+                raise ValueError("%s is not a related set of %s." %
+                        (k, self.model_class.__name__))
+        clone = self._clone()
+        clone._prefetch = clone._prefetch + names
+        return clone
+
+    def chunk_size(self, n):
+        """Sets the number of instances loaded per pipelined batch."""
+        clone = self._clone()
+        clone._chunk_size = n
+        return clone
+
     def create(self, **kwargs):
         instance = self.model_class(**kwargs)
         if instance.save():
@@ -122,6 +301,132 @@ class ModelSet(Set):
         else:
             return None
 
+    def bulk_create(self, instances, batch_size=None):
+        """Saves the new instances with one pipeline per batch.
+
+        All the instances are validated first. If any of them is
+        invalid, nothing is saved and None is returned; the errors are
+        in the errors attribute of the invalid instances. Otherwise
+        the ids of all the instances are reserved with a single INCRBY
+        and the list of instances is returned.
+
+        The instances are not locked since no one else can see them
+        yet. The instances of models with unique attributes are written
+        with the save script; those whose unique values turn out to be
+        taken, e.g. by an earlier instance of the list, are not saved:
+        they keep their errors and are left out of the returned list.
+        """
+        instances = list(instances)
+        for instance in instances:
+            if not instance.is_new():
+                raise ValueError("%r has already been saved." % instance)
+        if not all([instance.is_valid() for instance in instances]):
+            return None
+        if not instances:
+            return instances
+        last = self.db.incr(self.model_class._key['id'], len(instances))
+        first = last - len(instances) + 1
+        for instance, id in zip(instances, xrange(first, last + 1)):
+            instance.id = id
+        batch_size = batch_size or self._chunk_size
+        session = redisco.get_session()
+        uniques = self.model_class._uniques
+        optimistic = self.model_class._meta['optimistic']
+        saved = []
+        for i in xrange(0, len(instances), batch_size):
+            batch = instances[i:i + batch_size]
+            pipeline = self.db.pipeline(transaction=not uniques)
+            for instance in batch:
+                if uniques:
+                    keys, changes = instance._script_changes(True)
+                    scripts.run(pipeline, scripts.SAVE, keys,
+                                [scripts.encode(changes)])
+                else:
+                    instance._queue_write(pipeline, True)
+                    if optimistic:
+                        pipeline.hincrby(instance.key(), scripts.VERSION, 1)
+            replies = pipeline.execute()
+            for instance, reply in zip(batch, replies):
+                if uniques and reply == scripts.UNIQUE_CONFLICT:
+                    instance._errors = instance._unique_errors()
+                    del instance._id
+                    continue
+                if optimistic:
+                    instance.__dict__['_loaded_version'] = \
+                            str(reply) if uniques else '1'
+                instance._mark_clean()
+                saved.append(instance)
+        if session is not None:
+            for instance in saved:
+                session.add(instance)
+        return saved
+
+    def update(self, **kwargs):
+        """Sets the attributes, lists and references given as keyword
+        arguments on all the matching objects and returns the number
+        of objects changed.
+
+        The objects are not loaded: each batch of ids is written with
+        a pipeline of save scripts that move only the index entries of
+        the changed fields on the server, without taking locks. The
+        values are not validated, but objects are not changed when a
+        unique value they would get is held by another object. The
+        objects of models with indices defined in Meta are loaded first
+        to compute those indices.
+        """
+        model_class = self.model_class
+        for k in kwargs:
+            if (k not in model_class._attributes
+                    and k not in model_class._lists
+                    and k not in model_class._references):
+                raise ValueError("%s is not a field of %s." %
+                                 (k, model_class.__name__))
+            if k in model_class._counters:
+                raise ValueError("Counter %s cannot be updated." % k)
+        ids = self._distinct_ids()
+        computed = [k for k in model_class._indices
+                    if k not in model_class._attributes
+                    and k not in model_class._lists]
+        cache = model_class._meta['cache']
+        session = redisco.get_session()
+        updated = 0
+        for i in xrange(0, len(ids), self._chunk_size):
+            chunk = ids[i:i + self._chunk_size]
+            if computed:
+                instances = model_class.objects.in_bulk(chunk).values()
+            else:
+                instances = [self._get_item_with_id(id) for id in chunk]
+            pipeline = self.db.pipeline(transaction=False)
+            for instance in instances:
+                instance.update_attributes(**kwargs)
+                # counters cannot be updated, their indices are kept
+                keys, changes = instance._script_changes(counters=False)
+                changes['existing'] = True
+                scripts.run(pipeline, scripts.SAVE, keys,
+                            [scripts.encode(changes)])
+            for instance, reply in zip(instances, pipeline.execute()):
+                if reply > 0:
+                    updated += 1
+                if cache is not None:
+                    cache.invalidate(instance.key())
+                if session is not None:
+                    session.discard(instance.key())
+        return updated
+
+    def delete(self):
+        """Deletes all the matching objects, with their lists and index
+        entries, and returns the number of objects deleted.
+
+        The ids are resolved first, then each batch of them is deleted
+        on the server by a single script.
+        """
+        ids = self._distinct_ids()
+        deleted = 0
+        for i in xrange(0, len(ids), self._chunk_size):
+            deleted += self.model_class._delete_ids(
+                    ids[i:i + self._chunk_size])
+        return deleted
+
     def all(self):
         return self._clone()
 
@@ -154,47 +459,137 @@ class ModelSet(Set):
         if self._zfilters:
             self._cached_set = self._add_zfilters()
             return self._cached_set
-        s = Set(self.key)
+        s = self._filtered_set()
+        self._cached_set = list(self._order(s.key))
+        self._delete_temporary_keys()
+        return self._cached_set
+
+    def _filtered_set(self, pipeline=None):
+        """Stores the intersection of the filters and the difference
+        of the exclusions in temporary keys, and returns the Set of
+        the ids that match.
+
+        If pipeline is given, the commands are queued in it.
+        """
+        s = Set(self.key, pipeline=pipeline)
         self._expire_or_delete = []
         if self._filters:
             s = self._add_set_filter(s)
         if self._exclusions:
             s = self._add_set_exclusions(s)
-        n = self._order(s.key)
-        self._cached_set = list(self._order(s.key))
-        for key in filter(lambda key: key != self.key, self._expire_or_delete):
-            del self.db[key]
-        return self._cached_set
-
-    def _add_set_filter(self, s):
+        return s
+
+    def _delete_temporary_keys(self):
+        keys = [key for key in self._expire_or_delete if key != self.key]
+        if keys:
+            self.db.delete(*keys)
+
+    def _distinct_ids(self):
+        """Returns the ids of the set in order, each once: SSCAN may
+        return a member more than once.
+        """
+        seen = set()
+        ids = []
+        for chunk in self._iter_ids(self._chunk_size):
+            for id in chunk:
+                if id not in seen:
+                    seen.add(id)
+                    ids.append(id)
+        return ids
+
+    def _iter_ids(self, chunk_size):
+        """Yields the ids of the set in lists of about chunk_size ids,
+        without fetching all of them at once.
+        """
+        if hasattr(self, '_cached_set'):
+            for i in xrange(0, len(self._cached_set), chunk_size):
+                yield self._cached_set[i:i + chunk_size]
+            return
+        # scanned on a clone, whose temporary keys are its own, so that
+        # the queries run on the set in the meantime do not delete them
+        for ids in self._clone()._scan_ids(chunk_size):
+            yield ids
+
+    def _scan_ids(self, chunk_size):
+        """Yields the ids of the set read chunk_size at a time from
+        the indices or the temporary keys of the query.
+        """
+        if self._zfilters:
+            offset = self._offset or 0
+            while True:
+                n = chunk_size
+                if self._limit is not None:
+                    n = min(n, self._limit + (self._offset or 0) - offset)
+                if n <= 0:
+                    return
+                ids = self._add_zfilters(n, offset)
+                if ids:
+                    yield ids
+                if len(ids) < n:
+                    return
+                offset += n
+        s = self._filtered_set()
+        try:
+            if not self._ordering and self._limit is None:
+                cursor = 0
+                while True:
+                    cursor, ids = self.db.sscan(s.key, cursor,
+                                                count=chunk_size)
+                    if ids:
+                        yield ids
+                    if not cursor:
+                        break
+            else:
+                l = self._order(s.key)
+                start = 0
+                while True:
+                    ids = l.lrange(start, start + chunk_size - 1)
+                    if ids:
+                        yield ids
+                    if len(ids) < chunk_size:
+                        break
+                    start += chunk_size
+        finally:
+            self._delete_temporary_keys()
+
+    def _index_keys(self, filters):
+        """Returns the keys of the index sets of the filters."""
         indices = []
-        for k, v in self._filters.iteritems():
+        for k, v in filters.iteritems():
             index = self._build_key_from_filter_item(k, v)
             if k not in self.model_class._indices:
                 raise AttributeNotIndexed(
                         "Attribute %s is not indexed in %s class." %
                         (k, self.model_class.__name__))
             indices.append(index)
+        return indices
+
+    def _add_set_filter(self, s):
+        indices = self._index_keys(self._filters)
         new_set_key = "~%s.%s" % ("+".join([self.key] + indices), id(self))
         s.intersection(new_set_key, *[Set(n) for n in indices])
         self._expire_or_delete.append(new_set_key)
-        return Set(new_set_key)
+        return Set(new_set_key, pipeline=s.pipeline)
 
     def _add_set_exclusions(self, s):
-        indices = []
-        for k, v in self._exclusions.iteritems():
-            index = self._build_key_from_filter_item(k, v)
-            if k not in self.model_class._indices:
-                raise AttributeNotIndexed(
-                        "Attribute %s is not indexed in %s class." %
-                        (k, self.model_class.__name__))
-            indices.append(index)
+        indices = self._index_keys(self._exclusions)
         new_set_key = "~%s.%s" % ("-".join([self.key] + indices), id(self))
         s.difference(new_set_key, *[Set(n) for n in indices])
         self._expire_or_delete.append(new_set_key)
-        return Set(new_set_key)
-
-    def _add_zfilters(self):
+        return Set(new_set_key, pipeline=s.pipeline)
+
+    def _add_zfilters(self, limit=None, offset=None):
+        zset, min, max = self._zfilter_range()
+        if limit is None:
+            limit, offset = self._get_limit_and_offset()
+        if limit is not None and offset is None:
+            offset = 0
+        return zset.zrangebyscore(min, max, start=offset, num=limit)
+
+    def _zfilter_range(self):
+        """Returns the SortedSet index of the zfilter and the min and
+        max scores of its range.
+        """
         k, v = self._zfilters[0].items()[0]
         try:
             att, op = k.split('__')
@@ -203,7 +598,6 @@ class ModelSet(Set):
         index = self.model_class._key[att]
         desc = self.model_class._attributes[att]
         zset = SortedSet(index)
-        limit, offset = self._get_limit_and_offset()
         if isinstance(v, (tuple, list,)):
             min, max = v
             min = float(desc.typecast_for_storage(min))
@@ -211,15 +605,16 @@ class ModelSet(Set):
         else:
             v = float(desc.typecast_for_storage(v))
         if op == 'lt':
-            return zset.lt(v, limit, offset)
+            return zset, '-inf', "(%f" % v
         elif op == 'gt':
-            return zset.gt(v, limit, offset)
+            return zset, "(%f" % v, '+inf'
         elif op == 'gte':
-            return zset.ge(v, limit, offset)
+            return zset, v, '+inf'
         elif op == 'lte':
-            return zset.le(v, limit, offset)
+            return zset, '-inf', v
         elif op == 'in':
-            return zset.between(min, max, limit, offset)
+            return zset, min, max
+        raise ValueError("Unknown zfilter operator %s." % op)
 
     def _order(self, skey):
         if self._ordering:
@@ -262,6 +657,21 @@ class ModelSet(Set):
         self._expire_or_delete.append(new_set_key)
         return List(new_set_key)
 
+    def _sliced(self, start, stop):
+        """Returns a clone of the set limited to the items from start
+        to stop, or None if the range has no upper bound or counts
+        from the end.
+        """
+        if start < 0 or (stop is not None and stop < 0):
+            return None
+        limit = None if stop is None else max(0, stop - start)
+        if self._limit is not None:
+            rest = max(0, self._limit - start)
+            limit = rest if limit is None else min(limit, rest)
+        if limit is None:
+            return None
+        return self.limit(limit, (self._offset or 0) + start)
+
     def _get_limit_and_offset(self):
         if (self._limit is not None and self._offset is None) or \
                 (self._limit is None and self._offset is not None):
@@ -272,11 +682,170 @@ class ModelSet(Set):
         else:
             return (self._limit, self._offset)
 
-    def _get_item_with_id(self, id):
+    def _get_item_with_id(self, id, h=None, fields=None):
         instance = self.model_class()
         instance._id = str(id)
+        if h is not None:
+            instance._load_attributes(h, fields)
         return instance
 
+    def _get_items_with_ids(self, ids, existing_only=False):
+        """Returns the instances of ids loaded with the hashes
+        fetched in a single pipeline.
+
+        Uses HMGET when only some of the attributes are to be loaded.
+        If existing_only is True, the membership of the ids is checked
+        in the same pipeline and None is returned in place of the
+        objects that do not exist.
+        """
+        if hasattr(self, '_cached_items'):
+            return [self._cached_items.get(id) for id in ids]
+        session = redisco.get_session()
+        if session is not None:
+            found = dict((id, session.get(self.model_class._key[id]))
+                         for id in ids)
+            missing = [id for id in ids if found[id] is None]
+        else:
+            found, missing = {}, ids
+        cache = self.model_class._meta['cache']
+        if cache is not None:
+            uncached = []
+            for id in missing:
+                h = cache.get(self.model_class._key[id])
+                if h is None:
+                    uncached.append(id)
+                else:
+                    found[id] = self._get_item_with_id(id, h)
+                    if session is not None:
+                        session.add(found[id])
+            missing = uncached
+        fields = self._loaded_fields()
+        if fields is not None:
+            names = [self.model_class._attributes[k].name for k in fields]
+            if self.model_class._meta['optimistic']:
+                names.append(scripts.VERSION)
+        pipeline = self.db.pipeline(transaction=False)
+        for id in missing:
+            if existing_only:
+                pipeline.sismember(self.key, id)
+            if fields is None:
+                pipeline.hgetall(self.model_class._key[id])
+            elif names:
+                pipeline.hmget(self.model_class._key[id], names)
+        replies = iter(pipeline.execute() if missing else ())
+        for id in missing:
+            member = replies.next() if existing_only else True
+            if fields is None:
+                h = replies.next()
+            elif names:
+                h = dict(zip(names, replies.next()))
+            else:
+                h = {}
+            if member or any(v is not None for v in h.itervalues()):
+                found[id] = self._get_item_with_id(id, h, fields)
+                if cache is not None and fields is None:
+                    cache.set(self.model_class._key[id], h)
+                if session is not None:
+                    session.add(found[id])
+        instances = [found.get(id) for id in ids]
+        loaded = [o for o in instances if o is not None]
+        if self._related:
+            self._load_related(loaded)
+        if self._prefetch:
+            self._load_prefetched(loaded)
+        return instances
+
+    def _load_related(self, instances):
+        """Sets the cached referenced objects of the instances for
+        each of the fields passed to select_related.
+        """
+        for name in self._related:
+            field = self.model_class._references[name]
+            ids = set(getattr(o, field.attname) for o in instances)
+            ids.discard(None)
+            related = field.value_type().objects.in_bulk(ids)
+            for o in instances:
+                setattr(o, '_' + name, related.get(getattr(o, field.attname)))
+
+    def _iter_rows(self, fields):
+        """Yields the list of the typecasted values of fields for each
+        id of the set, reading one chunk of ids per pipeline.
+        """
+        atts = [self.model_class._attributes.get(k) for k in fields]
+        names = [att.name for att in atts if att is not None]
+        ids = self._set
+        for i in xrange(0, len(ids), self._chunk_size):
+            chunk = ids[i:i + self._chunk_size]
+            pipeline = self.db.pipeline(transaction=False)
+            if names:
+                for id in chunk:
+                    pipeline.hmget(self.model_class._key[id], names)
+                replies = pipeline.execute()
+            else:
+                replies = [[]] * len(chunk)
+            for id, values in zip(chunk, replies):
+                values = iter(values)
+                row = []
+                for att in atts:
+                    if att is None:
+                        row.append(id)
+                        continue
+                    val = values.next()
+                    if val is not None:
+                        val = att.typecast_for_read(val)
+                    row.append(val)
+                yield row
+
+    def _values_fields(self, fields):
+        if not fields:
+            return ['id'] + sorted(self.model_class._attributes.keys())
+        self._check_fields([k for k in fields if k != 'id'])
+        return list(fields)
+
+    def _loaded_fields(self):
+        """Returns the names of the attributes to load, or None if
+        all of them should be loaded.
+        """
+        if self._only is None and not self._deferred:
+            return None
+        fields = self._only
+        if fields is None:
+            fields = self.model_class._attributes.keys()
+        return [k for k in fields if k not in self._deferred]
+
+    def _check_fields(self, fields):
+        for k in fields:
+            if k not in self.model_class._attributes:
+                raise ValueError("%s is not an attribute of %s." %
+                        (k, self.model_class.__name__))
+
+    def _load_prefetched(self, instances):
+        """Caches the related sets passed to prefetch_related on the
+        instances.
+        """
+        for name in self._prefetch:
+            model_class, field = self.model_class._related_sets[name]
+            model_set = model_class.objects.get_model_set()
+            pipeline = self.db.pipeline(transaction=False)
+            for o in instances:
+                pipeline.smembers(model_set._build_key_from_filter_item(
+                    field.attname, o.id))
+            members = [sorted(ids, key=int) for ids in pipeline.execute()]
+            all_ids = list(set().union(*members))
+            items = dict(zip(all_ids, model_set._get_items_with_ids(all_ids)))
+            for o, ids in zip(instances, members):
+                related = model_set.filter(**{field.attname: o.id})
+                related._cached_set = ids
+                related._cached_items = dict((id, items[id]) for id in ids)
+                setattr(o, '_' + name, related)
+
+    def _iter_items(self, ids):
+        """Yields the loaded instances of ids, chunk by chunk."""
+        for i in xrange(0, len(ids), self._chunk_size):
+            for instance in self._get_items_with_ids(
+                    ids[i:i + self._chunk_size]):
+                yield instance
+
     def _build_key_from_filter_item(self, index, value):
         desc = self.model_class._attributes.get(index)
         if desc:
@@ -296,5 +865,26 @@ class ModelSet(Set):
             c._ordering = self._ordering
         c._limit = self._limit
         c._offset = self._offset
+        c._chunk_size = self._chunk_size
+        c._only = self._only
+        c._deferred = self._deferred
+        c._related = self._related
+        c._prefetch = self._prefetch
         return c
 
+
+def _in_range(score, min, max):
+    """Returns True if score is within the min and max scores, as
+    given to ZRANGEBYSCORE.
+    """
+    def bound(v):
+        if isinstance(v, basestring) and v.startswith('('):
+            return float(v[1:]), True
+        return float(v), False
+    low, low_excl = bound(min)
+    high, high_excl = bound(max)
+    if score < low or (low_excl and score == low):
+        return False
+    if score > high or (high_excl and score == high):
+        return False
+    return True
@@ -0,0 +1,210 @@
+"""
+Lua scripts run on the server to write, delete and lock models in a
+single round trip.
+"""
+import json
+
+# Redis limits the number of arguments unpack can pass to a call.
+_BATCH = """
+local function batch(command, key, values)
+    for i = 1, #values, 1000 do
+        local args = {}
+        for j = i, math.min(i + 999, #values) do
+            args[#args + 1] = values[j]
+        end
+        redis.call(command, key, unpack(args))
+    end
+end
+"""
+
+# returned by the save script when a unique value is taken
+UNIQUE_CONFLICT = -2
+
+# the field of the hash that holds the version of optimistic models
+VERSION = '_version'
+
+# KEYS: the hash, its _indices and _zindices sets and the set of all ids.
+# ARGV[1]: the changes to write, as encoded by Model._write_with_script.
+# Returns 0 without writing if the version of a versioned object is not
+# the one it was loaded with, -1 if existing is set and the object does
+# not exist, -2 if one of its unique values is held by another object,
+# its new version otherwise.
+SAVE = _BATCH + """
+local changes = cjson.decode(ARGV[1])
+local id = changes.id
+
+if changes.existing and redis.call('SISMEMBER', KEYS[4], id) == 0 then
+    return -1
+end
+
+if changes.versioned and changes.version ~= '' then
+    local version = redis.call('HGET', KEYS[1], '_version') or '0'
+    if version ~= changes.version then
+        return 0
+    end
+end
+
+-- claim the unique values and release the old ones
+for _, unique in ipairs(changes.uniques) do
+    if unique[3] ~= '' then
+        local owner = redis.call('HGET', unique[1], unique[3])
+        if owner and owner ~= id then
+            return -2
+        end
+    end
+end
+for _, unique in ipairs(changes.uniques) do
+    local old = redis.call('HGET', KEYS[1], unique[2])
+    if old and old ~= unique[3]
+            and redis.call('HGET', unique[1], old) == id then
+        redis.call('HDEL', unique[1], old)
+    end
+    if unique[3] ~= '' then
+        redis.call('HSET', unique[1], unique[3], id)
+    end
+end
+-- claim the unchanged unique values not claimed yet, e.g. of objects
+-- saved before the attribute was unique
+for _, claim in ipairs(changes.claims) do
+    local value = redis.call('HGET', KEYS[1], claim[2])
+    if value then
+        redis.call('HSETNX', claim[1], value, id)
+    end
+end
+
+local function remove(bookkeeping, command, keep)
+    local removed = {}
+    for _, index in ipairs(redis.call('SMEMBERS', bookkeeping)) do
+        if not keep(index) then
+            redis.call(command, index, id)
+            removed[#removed + 1] = index
+        end
+    end
+    if #removed > 0 then
+        batch('SREM', bookkeeping, removed)
+    end
+end
+
+if #changes.prefixes > 0 then
+    remove(KEYS[2], 'SREM', function(index)
+        for _, prefix in ipairs(changes.prefixes) do
+            if string.sub(index, 1, #prefix) == prefix then
+                return false
+            end
+        end
+        return true
+    end)
+    remove(KEYS[3], 'ZREM', function(index)
+        for _, zindex in ipairs(changes.zkeys) do
+            if index == zindex then
+                return false
+            end
+        end
+        return true
+    end)
+end
+
+if changes.new then
+    redis.call('DEL', KEYS[1])
+elseif #changes.deleted > 0 then
+    batch('HDEL', KEYS[1], changes.deleted)
+end
+if #changes.hash > 0 then
+    batch('HMSET', KEYS[1], changes.hash)
+end
+
+for _, index in ipairs(changes.unindexed) do
+    redis.call('SREM', index, id)
+    redis.call('SREM', KEYS[2], index)
+end
+for _, index in ipairs(changes.indices) do
+    redis.call('SADD', index, id)
+    redis.call('SADD', KEYS[2], index)
+end
+for _, zindex in ipairs(changes.zindices) do
+    redis.call('ZADD', zindex[1], zindex[2], id)
+    redis.call('SADD', KEYS[3], zindex[1])
+end
+
+for _, list in ipairs(changes.lists) do
+    for _, command in ipairs(list[2]) do
+        redis.call(command[1], list[1], unpack(command, 2))
+    end
+end
+
+redis.call('SADD', KEYS[4], id)
+if changes.channel ~= '' then
+    redis.call('PUBLISH', changes.channel, KEYS[1])
+end
+if changes.versioned then
+    return redis.call('HINCRBY', KEYS[1], '_version', 1)
+end
+return 1
+"""
+
+# KEYS: the set of all ids of the model.
+# ARGV[1]: the key prefix of the model, the ids to delete, the names of
+# its lists, the keys and fields of its unique values and the channel of
+# its cache, as encoded by Model._delete_ids.
+# Returns the number of objects deleted.
+DELETE = """
+local changes = cjson.decode(ARGV[1])
+local deleted = 0
+for _, id in ipairs(changes.ids) do
+    local key = changes.prefix .. ':' .. id
+    for _, unique in ipairs(changes.uniques) do
+        local value = redis.call('HGET', key, unique[2])
+        if value and redis.call('HGET', unique[1], value) == id then
+            redis.call('HDEL', unique[1], value)
+        end
+    end
+    for _, index in ipairs(redis.call('SMEMBERS', key .. ':_indices')) do
+        redis.call('SREM', index, id)
+    end
+    for _, zindex in ipairs(redis.call('SMEMBERS', key .. ':_zindices')) do
+        redis.call('ZREM', zindex, id)
+    end
+    redis.call('DEL', key, key .. ':_indices', key .. ':_zindices')
+    for _, list in ipairs(changes.lists) do
+        redis.call('DEL', key .. ':' .. list)
+    end
+    deleted = deleted + redis.call('SREM', KEYS[1], id)
+    if changes.channel ~= '' then
+        redis.call('PUBLISH', changes.channel, key)
+    end
+end
+return deleted
+"""
+
+# KEYS: the lock, the list its waiters block on and the key that marks
+# that there are waiters.
+# ARGV: the token of the holder and the expiry of the signal in ms.
+UNLOCK = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+if redis.call('EXISTS', KEYS[3]) == 1 then
+    redis.call('DEL', KEYS[2])
+    redis.call('RPUSH', KEYS[2], 1)
+    redis.call('PEXPIRE', KEYS[2], ARGV[2])
+end
+return 1
+"""
+
+_scripts = {}
+
+
+def run(db, source, keys, args=()):
+    """Runs the script source with EVALSHA, loading it on the
+    server first if needed.
+    """
+    script = _scripts.get(source)
+    if script is None:
+        script = _scripts[source] = db.register_script(source)
+    return script(keys=keys, args=args, client=db)
+
+
+def encode(changes):
+    """Encodes the changes passed to the write scripts."""
+    return json.dumps(changes)
@@ -0,0 +1,74 @@
+"""
+Identity map of the model instances loaded within a unit of work.
+"""
+import threading
+
+_local = threading.local()
+
+
+class Session(object):
+    """Keeps a single instance per model key.
+
+    While a session is active, objects loaded through the managers,
+    the model sets, reference fields and list fields are looked up in
+    the session first and the same instance is returned for the same
+    key, without a round trip to Redis.
+
+    Example:
+
+        with redisco.session():
+            a = Person.objects.get_by_id(1)
+            b = Person.objects.filter(name='Granny')[0]
+            assert a is b
+
+    """
+    def __init__(self):
+        self._instances = {}
+
+    def __enter__(self):
+        _stack().append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _stack().remove(self)
+        self.clear()
+
+    def get(self, key):
+        """Returns the instance stored at key or None."""
+        return self._instances.get(key)
+
+    def add(self, instance):
+        """Adds a saved instance to the session."""
+        self._instances[instance.key()] = instance
+
+    def discard(self, key):
+        """Removes the instance stored at key from the session."""
+        self._instances.pop(key, None)
+
+    def clear(self):
+        """Removes all instances from the session."""
+        self._instances.clear()
+
+    def __contains__(self, key):
+        return key in self._instances
+
+    def __len__(self):
+        return len(self._instances)
+
+
+def _stack():
+    if not hasattr(_local, 'sessions'):
+        _local.sessions = []
+    return _local.sessions
+
+
+def session():
+    """Returns a new session to be used as a context manager."""
+    return Session()
+
+
+def get_session():
+    """Returns the innermost active session of the current thread,
+    or None."""
+    stack = _stack()
+    return stack[-1] if stack else None
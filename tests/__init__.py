@@ -6,7 +6,7 @@ from containers import (SetTestCase, ListTestCase, TypedListTestCase,
 from models import (ModelTestCase, DateFieldTestCase, FloatFieldTestCase,
         BooleanFieldTestCase, ListFieldTestCase, ReferenceFieldTestCase,
         DateTimeFieldTestCase, CounterFieldTestCase, CharFieldTestCase,
-        MutexTestCase,)
+        MutexTestCase, SessionTestCase, HashCacheTestCase,)
 
 import redisco
 REDIS_DB = int(os.environ.get('REDIS_DB', 10)) # WARNING TESTS FLUSHDB!!!
@@ -33,4 +33,6 @@ def all_tests():
     suite.addTest(unittest.makeSuite(MutexTestCase))
     suite.addTest(unittest.makeSuite(HashTestCase))
     suite.addTest(unittest.makeSuite(CharFieldTestCase))
+    suite.addTest(unittest.makeSuite(SessionTestCase))
+    suite.addTest(unittest.makeSuite(HashCacheTestCase))
     return suite
@@ -206,6 +206,14 @@ class SetTestCase(unittest.TestCase):
         self.assertEqual(set(['a',]),
                 abc.sdiff(def_))
 
+    def test_batch_add(self):
+        fruits = cont.Set('fruits')
+        fruits.batch_size = 2
+        fruits.add('apples', 'oranges', 'pears')
+        fruits.update_from(iter(['kiwis', 'apples']))
+        self.assertEqual(set(['apples', 'oranges', 'pears', 'kiwis']),
+                fruits.all())
+
 
 class ListTestCase(unittest.TestCase):
     def setUp(self):
@@ -325,6 +333,20 @@ class ListTestCase(unittest.TestCase):
         self.assertEqual('a', l.lpop())
         self.assertEqual('b', l.rpop())
 
+    def test_batch_push(self):
+        alpha = cont.List('alpha')
+        alpha.batch_size = 2
+        alpha.extend(iter('cde'))
+        alpha.unshift_many(['a', 'b'])
+        self.assertEqual(list('abcde'), alpha.members)
+
+        pipeline = self.client.pipeline()
+        cont.List('alpha', pipeline=pipeline).extend('fgh')
+        self.assertEqual(list('abcde'), alpha.members)
+        pipeline.execute()
+        self.assertEqual(list('abcdefgh'), alpha.members)
+
+
 class TypedListTestCase(unittest.TestCase):
     def setUp(self):
         self.client = redisco.get_client()
@@ -365,6 +387,8 @@ class TypedListTestCase(unittest.TestCase):
 
         l = cont.TypedList('friends', 'Person')
         l.extend(Person.objects.all())
+        l.chunk_size = 1
+        self.assertEquals([iamteam, clayg], list(l))
 
         for person in l:
             if person.name == 'clayg':
@@ -417,6 +441,13 @@ class SortedSetTestCase(unittest.TestCase):
         self.assertEqual(list(reversed(zset)), zset.zrevrange(0, -1))
         self.assertEqual(list(reversed(zset)), list(zset.__reversed__()))
 
+    def test_add_many(self):
+        zorted = cont.SortedSet("Person:age")
+        zorted.batch_size = 2
+        zorted.add_many({"1": 29, "2": 39, "3": 15, "4": 35, "5": 98})
+        self.assertEqual(["3", "1", "4", "2", "5"], zorted.members)
+        self.assertEqual(35, zorted.score("4"))
+
 
 class HashTestCase(unittest.TestCase):
     def setUp(self):
@@ -459,6 +490,14 @@ class HashTestCase(unittest.TestCase):
         h.hmset({'Blue': 100, 'Green': 19, 'Yellow': 1024})
         self.assertEqual(['100', '19'], h.hmget(['Blue', 'Green']))
 
+    def test_update(self):
+        h = cont.Hash('my_hash')
+        h.batch_size = 2
+        h.update({'Blue': 100, 'Green': 19}, Yellow=1024, Red=1)
+        h.update([('Blue', 101)])
+        self.assertEqual({'Blue': '101', 'Green': '19', 'Yellow': '1024',
+                          'Red': '1'}, self.client.hgetall('my_hash'))
+
 if __name__ == "__main__":
     import sys
     unittest.main(argv=sys.argv)
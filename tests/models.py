@@ -5,7 +5,7 @@ import base64
 import redis
 import redisco
 import unittest
-from datetime import date
+from datetime import date, datetime, timedelta
 from redisco import models
 from redisco.models.base import Mutex
 
@@ -88,6 +88,195 @@ class ModelTestCase(RediscoTestCase):
         self.assertEqual("Morgan", p.first_name)
         self.assertEqual(None, p.last_name)
 
+    def test_update_writes_changed_fields_only(self):
+        Person.objects.create(first_name="Granny", last_name="Goose")
+
+        p = Person.objects.get_by_id('1')
+        self.client.hset('Person:1', 'last_name', 'Mommy')
+        p.first_name = "Morgan"
+        assert p.save()
+
+        self.assertEqual({'first_name': 'Morgan', 'last_name': 'Mommy',
+                          'full_name': 'Morgan Goose'},
+                self.client.hgetall('Person:1'))
+        self.assertEqual(0, Person.objects.filter(first_name="Granny").count())
+        self.assertEqual(1, Person.objects.filter(first_name="Morgan").count())
+        self.assertEqual(1, Person.objects.filter(last_name="Goose").count())
+        self.assertEqual(1,
+                Person.objects.filter(full_name="Morgan Goose").count())
+        self.assertEqual(0,
+                Person.objects.filter(full_name="Granny Goose").count())
+        self.assertEqual(3, self.client.scard('Person:1:_indices'))
+
+        p = Person.objects.get_by_id('1')
+        p.last_name = None
+        assert p.save()
+        self.assertEqual({'first_name': 'Morgan', 'full_name': 'Morgan None'},
+                self.client.hgetall('Person:1'))
+        self.assertEqual(0, Person.objects.filter(last_name="Mommy").count())
+
+    def test_unchanged_lists_are_not_written(self):
+        class Cake(models.Model):
+            name = models.CharField()
+            sizes = models.ListField(int)
+
+        Cake.objects.create(name="StrCake", sizes=[1, 2, 5])
+        cake = Cake.objects.get_by_id(1)
+        self.assertEqual([1, 2, 5], cake.sizes)
+        self.client.rpush('Cake:1:sizes', 8)
+        cake.name = "Strawberry Cake"
+        assert cake.save()
+        self.assertEqual(['1', '2', '5', '8'],
+                self.client.lrange('Cake:1:sizes', 0, -1))
+
+        cake.sizes = [1, 2]
+        assert cake.save()
+        self.assertEqual(['1', '2'],
+                self.client.lrange('Cake:1:sizes', 0, -1))
+        self.assertEqual(1, Cake.objects.filter(sizes=2).count())
+        self.assertEqual(0, Cake.objects.filter(sizes=5).count())
+
+    def test_list_changes_are_written_as_diffs(self):
+        class Cake(models.Model):
+            name = models.CharField()
+            sizes = models.ListField(int)
+
+        field = Cake._lists['sizes']
+        self.assertEqual([], field.commands_for_storage([1, 2], [1, 2]))
+        self.assertEqual([('RPUSH', 3, 4)],
+                field.commands_for_storage([1, 2, 3, 4], [1, 2]))
+        self.assertEqual([('LTRIM', 0, 0)],
+                field.commands_for_storage([1], [1, 2]))
+        self.assertEqual([('LSET', 1, 5)],
+                field.commands_for_storage([1, 5, 3], [1, 2, 3]))
+        self.assertEqual([('LREM', 0, 2)],
+                field.commands_for_storage([1, 3], [2, 1, 2, 3]))
+        self.assertEqual([('DEL',), ('RPUSH', 3, 2, 1)],
+                field.commands_for_storage([3, 2, 1], [1, 2, 3]))
+        self.assertEqual([('DEL',)], field.commands_for_storage([], [1]))
+
+        Cake.objects.create(name="StrCake", sizes=range(1500))
+        self.assertEqual(1500, self.client.llen('Cake:1:sizes'))
+        cake = Cake.objects.get_by_id(1)
+        self.assertEqual(1500, len(cake.sizes))
+        self.client.rpush('Cake:1:sizes', 9999)
+        cake.sizes.append(1500)
+        assert cake.save()
+        self.assertEqual(['1499', '9999', '1500'],
+                self.client.lrange('Cake:1:sizes', -3, -1))
+        self.assertEqual(1, Cake.objects.filter(sizes=1500).count())
+        self.assertEqual(1502, self.client.scard('Cake:1:_indices'))
+
+        cake = Cake.objects.get_by_id(1)
+        cake.sizes[0] = 7
+        assert cake.save()
+        cake.sizes.remove(8)
+        assert cake.save()
+        self.assertEqual(['7', '1', '2', '3', '4', '5', '6', '7', '9'],
+                self.client.lrange('Cake:1:sizes', 0, 8))
+        self.assertEqual(0, Cake.objects.filter(sizes=0).count())
+        self.assertEqual(0, Cake.objects.filter(sizes=8).count())
+        self.assertEqual(1, Cake.objects.filter(sizes=7).count())
+
+        cake.sizes = cake.sizes[:3]
+        assert cake.save()
+        self.assertEqual(['7', '1', '2'],
+                self.client.lrange('Cake:1:sizes', 0, -1))
+        self.assertEqual(4, self.client.scard('Cake:1:_indices'))
+
+    def test_atomic_save(self):
+        class Pie(models.Model):
+            name = models.CharField()
+            flavor = models.Attribute()
+            price = models.IntegerField()
+            fillings = models.ListField(unicode)
+
+            class Meta:
+                atomic_save = True
+
+        pie = Pie(name="Apple", flavor=u"sweet", price=3,
+                  fillings=[u"apple", u"cinnamon"])
+        assert pie.save()
+        self.assertFalse(self.client.exists('Pie:1:_lock'))
+        self.assertEqual({'name': 'Apple', 'flavor': 'sweet', 'price': '3'},
+                self.client.hgetall('Pie:1'))
+        self.assertEqual(['apple', 'cinnamon'],
+                self.client.lrange('Pie:1:fillings', 0, -1))
+        self.assertEqual(5, self.client.scard('Pie:1:_indices'))
+
+        pie = Pie.objects.get_by_id(1)
+        pie.flavor = None
+        pie.price = 5
+        pie.fillings.append(u"cream")
+        pie.name = u"Cr\xe8me"
+        assert pie.save()
+        self.assertEqual({'name': 'Cr\xc3\xa8me', 'price': '5'},
+                self.client.hgetall('Pie:1'))
+        self.assertEqual(0, Pie.objects.filter(flavor="sweet").count())
+        self.assertEqual(0, Pie.objects.filter(price=3).count())
+        self.assertEqual(1, Pie.objects.filter(price=5).count())
+        self.assertEqual(1, Pie.objects.zfilter(price__gt=4).count())
+        self.assertEqual(0, Pie.objects.filter(name="Apple").count())
+        self.assertEqual(1, Pie.objects.filter(name=u"Cr\xe8me").count())
+        self.assertEqual(1, Pie.objects.filter(fillings="cream").count())
+        self.assertEqual([u"apple", u"cinnamon", u"cream"],
+                Pie.objects.get_by_id(1).fillings)
+        self.assertEqual(set(['1']), self.client.smembers('Pie:all'))
+
+    def test_optimistic_save(self):
+        for atomic in (False, True):
+            self.client.flushdb()
+
+            class Tart(models.Model):
+                name = models.CharField()
+                sold = models.Counter()
+
+                class Meta:
+                    optimistic = True
+                    atomic_save = atomic
+
+            Tart.objects.create(name="Lemon")
+            self.assertEqual('1', self.client.hget('Tart:1', '_version'))
+            t1 = Tart.objects.get_by_id(1)
+            t2 = Tart.objects.get_by_id(1)
+            t1.incr('sold')
+            t1.name = "Lime"
+            assert t1.save()
+            self.assertFalse(self.client.exists('Tart:1:_lock'))
+            self.assertEqual('2', self.client.hget('Tart:1', '_version'))
+
+            t2.name = "Orange"
+            self.assertRaises(models.ConflictError, t2.save)
+            self.assertEqual("Lime", Tart.objects.get_by_id(1).name)
+            self.assertEqual(1, Tart.objects.filter(name="Lime").count())
+            self.assertEqual(0, Tart.objects.filter(name="Orange").count())
+
+            t1.name = "Lemon"
+            assert t1.save()
+            self.assertEqual('3', self.client.hget('Tart:1', '_version'))
+            self.assertEqual(1, Tart.objects.get_by_id(1).sold)
+
+            # partially loaded instances are checked too
+            t3 = Tart.objects.only('name')[0]
+            t4 = Tart.objects.in_bulk([1], fields=['name'])[1]
+            t1.name = "Lime"
+            assert t1.save()
+            t3.name = "Orange"
+            self.assertRaises(models.ConflictError, t3.save)
+            t4.name = "Orange"
+            self.assertRaises(models.ConflictError, t4.save)
+            self.assertEqual("Lime", Tart.objects.get_by_id(1).name)
+
+            # instances returned by bulk_create are versioned too
+            t5, = Tart.objects.bulk_create([Tart(name="Plum")])
+            self.assertEqual('1', self.client.hget(t5.key(), '_version'))
+            t6 = Tart.objects.get_by_id(t5.id)
+            t6.name = "Cherry"
+            assert t6.save()
+            t5.name = "Apricot"
+            self.assertRaises(models.ConflictError, t5.save)
+            self.assertEqual("Cherry", Tart.objects.get_by_id(t5.id).name)
+
     def test_default_CharField_val(self):
         class User(models.Model):
             views = models.IntegerField(default=199)
@@ -121,6 +310,33 @@ class ModelTestCase(RediscoTestCase):
         self.assertEqual('Granny', p1.first_name)
         self.assertEqual('Goose', p1.last_name)
 
+    def test_in_bulk(self):
+        Person.objects.create(first_name="Granny", last_name="Goose")
+        Person.objects.create(first_name="Clark", last_name="Kent")
+        Person.objects.create(first_name="Lois", last_name="Lane")
+
+        persons = Person.objects.in_bulk([3, '1', 7])
+        self.assertEqual([3, '1'], sorted(persons.keys()))
+        self.assertEqual("Lois Lane", persons[3].full_name())
+        self.assertEqual('3', persons[3].id)
+        self.assertTrue('_last_name' in persons['1'].__dict__)
+
+        persons = Person.objects.in_bulk(['2'], fields=['first_name'])
+        self.assertTrue('_first_name' in persons['2'].__dict__)
+        self.assertFalse('_last_name' in persons['2'].__dict__)
+        self.assertEqual({}, Person.objects.in_bulk([]))
+
+    def test_get_by_id_loads_attributes(self):
+        Person.objects.create(first_name="Granny", last_name="Goose")
+
+        p = Person.objects.get_by_id(1)
+        self.assertTrue('_first_name' in p.__dict__)
+        self.assertTrue('_last_name' in p.__dict__)
+        self.assertEqual("Granny Goose", p.full_name())
+        self.assertEqual(None, Person.objects.get_by_id(2))
+        self.assertTrue(Person.exists(1))
+        self.assertFalse(Person.exists(2))
+
     def test_manager_create(self):
         person = Person.objects.create(first_name="Granny", last_name="Goose")
 
@@ -128,6 +344,98 @@ class ModelTestCase(RediscoTestCase):
         self.assertEqual('Granny', p1.first_name)
         self.assertEqual('Goose', p1.last_name)
 
+    def test_bulk_create(self):
+        Person.objects.create(first_name="Granny", last_name="Goose")
+        persons = [Person(first_name="Clark", last_name="Kent"),
+                   Person(first_name="Lois", last_name="Lane"),
+                   Person(first_name="Lex", last_name="Luthor")]
+        self.assertEqual(persons,
+                Person.objects.bulk_create(persons, batch_size=2))
+        self.assertEqual(['2', '3', '4'], [p.id for p in persons])
+        self.assertEqual('4', self.client.get('Person:id'))
+        self.assertEqual(4, len(Person.objects.all()))
+        self.assertEqual("Lois Lane",
+                Person.objects.filter(full_name="Lois Lane")[0].full_name())
+        self.assertEqual(persons[2],
+                Person.objects.filter(last_name="Luthor").first())
+        self.assertRaises(ValueError, Person.objects.bulk_create, persons)
+
+        class Student(models.Model):
+            name = models.CharField(required=True)
+
+        students = [Student(name="Richard"), Student()]
+        self.assertEqual(None, Student.objects.bulk_create(students))
+        self.assertEqual([('name', 'required')], students[1].errors)
+        self.assertEqual(0, len(Student.objects.all()))
+
+    def test_modelset_update(self):
+        class Book(models.Model):
+            title = models.CharField()
+            pages = models.IntegerField()
+            read = models.BooleanField()
+            notes = models.Attribute(indexed=False)
+
+        for i in range(5):
+            Book.objects.create(title="Book %d" % i, pages=100 + i,
+                                read=False, notes="note")
+        self.client.srem('Book:all', '5')
+        self.assertEqual(1, Book.objects.zfilter(pages__gte=103)
+                                        .chunk_size(1)
+                                        .update(pages=50, read=True,
+                                                notes=None))
+        self.assertEqual(set(['4']),
+                self.client.smembers('Book:pages:' + base64.b64encode('50')))
+        self.assertEqual(['4'], [b.id for b in
+                Book.objects.zfilter(pages__lt=100)])
+        self.assertEqual(['4'], [b.id for b in
+                Book.objects.filter(read=True)])
+        self.assertEqual(3, Book.objects.filter(read=False).count())
+        self.assertEqual(0, Book.objects.filter(pages=103).count())
+        self.assertEqual({'title': 'Book 3', 'pages': '50', 'read': '1'},
+                self.client.hgetall('Book:4'))
+        self.assertEqual(1, Book.objects.filter(title="Book 3").count())
+
+        self.assertEqual(2, Person.objects.bulk_create(
+                [Person(first_name="Clark", last_name="Kent"),
+                 Person(first_name="Lois", last_name="Lane")]) and
+                Person.objects.update(last_name="Luthor"))
+        self.assertEqual(0, Person.objects.filter(last_name="Kent").count())
+        self.assertEqual(["Clark Luthor"],
+                [p.full_name() for p in
+                 Person.objects.filter(full_name="Clark Luthor")])
+        self.assertRaises(ValueError, Person.objects.update, age=3)
+
+        # SSCAN may return a member more than once
+        books = Book.objects.all()
+        books._iter_ids = lambda chunk_size: iter([['1', '2'], ['2', '1']])
+        self.assertEqual(2, books.update(notes="again"))
+
+    def test_id_block_allocator(self):
+        class Tweet(models.Model):
+            status = models.CharField()
+
+            class Meta:
+                id_block_size = 3
+
+        tweets = [Tweet.objects.create(status="#%d" % i) for i in range(4)]
+        self.assertEqual(['1', '2', '3', '4'], [t.id for t in tweets])
+        self.assertEqual('6', self.client.get('Tweet:id'))
+        self.assertEqual(self.client.incr('Tweet:id'), 7)
+        self.assertEqual('5', Tweet.objects.create(status="#5").id)
+        self.assertEqual("#5", Tweet.objects.get_by_id(5).status)
+
+        ids = []
+        def create():
+            for i in range(10):
+                ids.append(Tweet.objects.create(status="thread").id)
+        threads = [Thread(target=create) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(40, len(set(ids)))
+        self.assertFalse(set(['1', '2', '3', '4', '5', '7']) & set(ids))
+
     def test_indices(self):
         person = Person.objects.create(first_name="Granny", last_name="Goose")
         db = person.db
@@ -166,6 +474,27 @@ class ModelTestCase(RediscoTestCase):
 
         self.assertEqual(0, self.client.zcard("Event:created_on"))
 
+    def test_modelset_delete(self):
+        class Album(models.Model):
+            title = models.CharField()
+            year = models.IntegerField()
+            tracks = models.ListField(str)
+
+        for i in range(5):
+            Album.objects.create(title="Album %d" % i, year=2000 + i % 2,
+                                 tracks=["a", "b"])
+        self.assertEqual(3, Album.objects.filter(year=2000)
+                                         .chunk_size(2).delete())
+        self.assertEqual(['2', '4'], [a.id for a in Album.objects.all()])
+        self.assertEqual(0, Album.objects.zfilter(year__lt=2001).count())
+        self.assertEqual(0, Album.objects.filter(title="Album 0").count())
+        self.assertFalse(self.client.exists('Album:1:tracks'))
+        self.assertTrue(self.client.exists('Album:2:tracks'))
+        self.assertEqual(0, Album.objects.filter(year=2000).delete())
+
+        self.assertEqual(2, Album.objects.truncate())
+        self.assertEqual(['Album:id'], self.client.keys('Album*'))
+
 
     def test_filter(self):
         Person.objects.create(first_name="Granny", last_name="Goose")
@@ -234,6 +563,173 @@ class ModelTestCase(RediscoTestCase):
             self.assertTrue(person.full_name() in ("Granny Goose",
                 "Clark Kent", "Granny Mommy", "Granny Kent",))
 
+    def test_iter_loads_attributes(self):
+        Person.objects.create(first_name="Granny", last_name="Goose")
+        Person.objects.create(first_name="Clark", last_name="Kent")
+        Person.objects.create(first_name="Granny", last_name="Mommy")
+
+        persons = list(Person.objects.all().chunk_size(2))
+        self.assertEqual(3, len(persons))
+        for person in persons:
+            self.assertTrue('_first_name' in person.__dict__)
+            self.assertTrue('_last_name' in person.__dict__)
+        self.assertEqual("Clark Kent", persons[1].full_name())
+
+    def test_only_and_defer(self):
+        Person.objects.create(first_name="Granny", last_name="Goose")
+        Person.objects.create(first_name="Clark", last_name="Kent")
+
+        persons = list(Person.objects.only('first_name'))
+        self.assertTrue('_first_name' in persons[0].__dict__)
+        self.assertFalse('_last_name' in persons[0].__dict__)
+        self.assertEqual("Granny Goose", persons[0].full_name())
+
+        persons = list(Person.objects.filter(first_name="Clark")
+                .defer('first_name'))
+        self.assertFalse('_first_name' in persons[0].__dict__)
+        self.assertTrue('_last_name' in persons[0].__dict__)
+        self.assertEqual("Clark Kent", persons[0].full_name())
+
+        self.assertRaises(ValueError, Person.objects.only, 'middle_name')
+
+    def test_values(self):
+        Person.objects.create(first_name="Granny", last_name="Goose")
+        Person.objects.create(first_name="Clark", last_name="Kent")
+
+        self.assertEqual([{'id': '1', 'first_name': 'Granny',
+                           'last_name': 'Goose'},
+                          {'id': '2', 'first_name': 'Clark',
+                           'last_name': 'Kent'}],
+                         list(Person.objects.values()))
+        self.assertEqual([{'last_name': 'Kent'}],
+                list(Person.objects.filter(first_name="Clark")
+                    .values('last_name')))
+        self.assertEqual([('Goose', '1'), ('Kent', '2')],
+                list(Person.objects.values_list('last_name', 'id')))
+        self.assertEqual(['Granny', 'Clark'],
+                list(Person.objects.values_list('first_name', flat=True)))
+        self.assertRaises(TypeError, Person.objects.all().values_list,
+                'first_name', 'last_name', flat=True)
+
+    def test_values_typecast(self):
+        class Exam(models.Model):
+            score = models.IntegerField()
+            passed = models.BooleanField()
+
+        Exam.objects.create(score=9, passed=False)
+        Exam.objects.create(score=99, passed=True)
+        self.assertEqual([(9, False), (99, True)],
+                list(Exam.objects.values_list('score', 'passed')))
+
+    def test_iterator(self):
+        for i in range(7):
+            Person.objects.create(first_name="Granny", last_name="#%d" % i)
+        Person.objects.create(first_name="Clark", last_name="Kent")
+
+        persons = list(Person.objects.filter(first_name="Granny")
+                .iterator(chunk_size=3))
+        self.assertEqual(7, len(persons))
+        self.assertEqual(set(map(str, range(1, 8))),
+                set(p.id for p in persons))
+        self.assertEqual([], self.client.keys('~*'))
+
+        persons = list(Person.objects.order('-last_name').limit(5, offset=1)
+                .iterator(chunk_size=2))
+        self.assertEqual(['#6', '#5', '#4', '#3', '#2'],
+                [p.last_name for p in persons])
+        self.assertEqual([], self.client.keys('*#*'))
+
+        class Exam(models.Model):
+            score = models.IntegerField()
+
+        for score in (9, 99, 75, 33, 95):
+            Exam.objects.create(score=score)
+        exams = Exam.objects.zfilter(score__in=(10, 100)).limit(3, offset=1)
+        self.assertEqual([75, 95, 99],
+                [e.score for e in exams.iterator(chunk_size=2)])
+
+    def test_queries_during_iteration(self):
+        for i in range(5):
+            Person.objects.create(first_name="Granny", last_name="#%d" % i)
+        grannies = Person.objects.filter(first_name="Granny")
+        seen = []
+        for p in grannies.iterator(chunk_size=2):
+            self.assertEqual(5, grannies.count())
+            self.assertEqual(5, len(list(grannies.iterator())))
+            seen.append(p.id)
+        self.assertEqual(5, len(seen))
+
+        ordered = grannies.order('last_name')
+        nested = [(p.last_name, q.last_name)
+                  for p in ordered.iterator(chunk_size=2)
+                  for q in ordered.iterator(chunk_size=2)]
+        self.assertEqual(25, len(nested))
+        self.assertEqual([], self.client.keys('~*'))
+        self.assertEqual([], self.client.keys('*#*'))
+
+    def test_count(self):
+        Person.objects.create(first_name="Granny", last_name="Goose")
+        Person.objects.create(first_name="Clark", last_name="Kent")
+        Person.objects.create(first_name="Granny", last_name="Mommy")
+        Person.objects.create(first_name="Granny", last_name="Kent")
+
+        self.assertEqual(4, Person.objects.all().count())
+        grannies = Person.objects.filter(first_name="Granny")
+        self.assertEqual(3, grannies.count())
+        self.assertEqual(3, len(grannies))
+        self.assertFalse(hasattr(grannies, '_cached_set'))
+        self.assertEqual(2, grannies.exclude(last_name="Kent").count())
+        self.assertEqual(2, grannies.limit(2).count())
+        self.assertEqual(1, grannies.limit(2, offset=2).count())
+        self.assertEqual([], self.client.keys('~*'))
+
+        class Exam(models.Model):
+            score = models.IntegerField()
+
+        for score in (9, 99, 75, 33, 95):
+            Exam.objects.create(score=score)
+        self.assertEqual(3, Exam.objects.zfilter(score__gte=75).count())
+        self.assertEqual(2, Exam.objects.zfilter(score__lt=75).count())
+        self.assertEqual(3, Exam.objects.zfilter(score__in=(33, 95)).count())
+        self.assertEqual(3, len(Exam.objects.zfilter(score__gte=75)))
+
+    def test_contains(self):
+        granny = Person.objects.create(first_name="Granny", last_name="Goose")
+        clark = Person.objects.create(first_name="Clark", last_name="Kent")
+        mommy = Person.objects.create(first_name="Granny", last_name="Mommy")
+
+        self.assertTrue(clark in Person.objects.all())
+        grannies = Person.objects.filter(first_name="Granny")
+        self.assertTrue(granny in grannies)
+        self.assertFalse(clark in grannies)
+        self.assertFalse(hasattr(grannies, '_cached_set'))
+        self.assertFalse(mommy in grannies.exclude(last_name="Mommy"))
+        self.assertTrue(granny in grannies.exclude(last_name="Mommy"))
+        self.assertFalse(Event.objects.create(name="Party", date=date.today())
+                in Person.objects.all())
+        mommy.delete()
+        self.assertFalse(mommy in Person.objects.all())
+
+        class Exam(models.Model):
+            score = models.IntegerField()
+
+        exams = [Exam.objects.create(score=score) for score in (9, 75, 99)]
+        self.assertTrue(exams[1] in Exam.objects.zfilter(score__gte=75))
+        self.assertFalse(exams[1] in Exam.objects.zfilter(score__gt=75))
+        self.assertTrue(exams[0] in Exam.objects.zfilter(score__in=(0, 10)))
+        self.assertFalse(exams[2] in Exam.objects.zfilter(score__lt=99))
+
+        class Ev(models.Model):
+            at = models.DateTimeField()
+
+        dt = datetime(2020, 1, 2, 3, 4, 5, 123456)
+        ev = Ev.objects.create(at=dt)
+        self.assertEqual([ev], list(Ev.objects.zfilter(at__lte=dt)))
+        self.assertTrue(ev in Ev.objects.zfilter(at__lte=dt))
+        self.assertTrue(ev in Ev.objects.zfilter(at__gte=dt))
+        self.assertFalse(ev in Ev.objects.zfilter(
+                at__lte=dt - timedelta(microseconds=1000)))
+
     def test_sort(self):
         Person.objects.create(first_name="Zeddicus", last_name="Zorander")
         Person.objects.create(first_name="Richard", last_name="Cypher")
@@ -467,6 +963,76 @@ class ModelTestCase(RediscoTestCase):
         student = Student()
         self.assertTrue(student.is_valid())
 
+    def test_unique_values_index(self):
+        class Coupon(models.Model):
+            code = models.CharField(unique=True)
+            owner = models.CharField()
+
+        c = Coupon.objects.create(code="XMAS", owner="Santa")
+        self.assertEqual({'XMAS': '1'}, self.client.hgetall('Coupon:_unique:code'))
+        self.assertFalse(self.client.exists('Coupon:1:_lock'))
+        c.owner = "Rudolph"
+        assert c.save()
+        c = Coupon.objects.get_by_id(1)
+        self.assertTrue(c.is_valid())
+        c.code = "NOEL"
+        assert c.save()
+        self.assertEqual({'NOEL': '1'}, self.client.hgetall('Coupon:_unique:code'))
+        self.assertTrue(Coupon(code="XMAS").is_valid())
+
+        # claimed by another writer after the validation
+        taken = Coupon(code="EASTER")
+        taken.is_valid = lambda: True
+        self.client.hset('Coupon:_unique:code', 'EASTER', '99')
+        self.assertEqual([('code', 'not unique')], taken.save())
+        self.assertTrue(taken.is_new())
+        self.assertFalse(self.client.exists('Coupon:2'))
+
+        coupons = [Coupon(code="A"), Coupon(code="B"), Coupon(code="A")]
+        self.assertEqual(coupons[:2], Coupon.objects.bulk_create(coupons))
+        self.assertTrue(coupons[2].is_new())
+        self.assertEqual([('code', 'not unique')], coupons[2].errors)
+        self.assertEqual(1, Coupon.objects.filter(code="A").count())
+
+        self.assertEqual(1, Coupon.objects.exclude(code="NOEL")
+                                          .update(code="C"))
+        self.assertEqual(1, Coupon.objects.filter(code="C").count())
+        self.assertEqual(2, Coupon.objects.filter(code="C").delete()
+                            + Coupon.objects.filter(code="NOEL").delete())
+        remaining = Coupon.objects.all()[0]
+        self.assertEqual({'EASTER': '99', remaining.code: remaining.id},
+                self.client.hgetall('Coupon:_unique:code'))
+
+    def test_unique_values_of_existing_objects(self):
+        class Coupon(models.Model):
+            code = models.CharField(unique=True)
+            owner = models.CharField()
+
+        # saved before the field was unique
+        for id, code in (('1', 'XMAS'), ('2', 'NOEL'), ('3', 'XMAS')):
+            self.client.hmset('Coupon:%s' % id, {'code': code, 'owner': 'x'})
+            self.client.sadd('Coupon:all', id)
+        self.client.set('Coupon:id', 3)
+
+        c = Coupon.objects.get_by_id(1)
+        assert c.save()
+        self.assertEqual({'XMAS': '1'}, self.client.hgetall('Coupon:_unique:code'))
+        self.assertEqual([('code', 'not unique')], Coupon(code="XMAS").save())
+
+        c = Coupon.objects.get_by_id(2)
+        c.owner = "Santa"
+        assert c.save()
+        self.assertEqual('2', self.client.hget('Coupon:_unique:code', 'NOEL'))
+
+        self.client.delete('Coupon:_unique:code')
+        clashes = Coupon.objects.rebuild_unique_index()
+        self.assertEqual(1, len(clashes))
+        id, att, value, owner = clashes[0]
+        self.assertEqual(('code', 'XMAS'), (att, value))
+        self.assertEqual(set(['1', '3']), set([id, owner]))
+        self.assertEqual({'XMAS': owner, 'NOEL': '2'},
+                         self.client.hgetall('Coupon:_unique:code'))
+
     def test_long_integers(self):
         class Tweet(models.Model):
             status_id = models.IntegerField()
@@ -510,6 +1076,28 @@ class ModelTestCase(RediscoTestCase):
         self.assertEqual(Person.objects.get_by_id('3'), a[0])
         self.assertEqual("Martha Kent", a[3].full_name())
 
+    def test_slicing_is_limited(self):
+        for name in ("Granny", "Clark", "Lois", "Jonathan", "Martha", "Lex"):
+            Person.objects.create(first_name=name, last_name="Kent")
+
+        a = Person.objects.order('first_name')
+        self.assertEqual(["Granny", "Jonathan"],
+                [p.first_name for p in a[1:3]])
+        self.assertFalse(hasattr(a, '_cached_set'))
+        self.assertEqual("Lex", a[3].first_name)
+        self.assertRaises(IndexError, a.__getitem__, 6)
+        self.assertEqual("Martha", a[-1].first_name)
+
+        a = Person.objects.order('first_name').limit(3, offset=2)
+        self.assertEqual(["Lex", "Lois"], [p.first_name for p in a[1:5]])
+        self.assertEqual("Jonathan", a.first().first_name)
+        self.assertEqual([], a[3:5])
+        self.assertEqual(None, a.filter(last_name="Luthor").first())
+
+        a = Person.objects.all()
+        self.assertEqual(['3', '4'], [p.id for p in a[2:4]])
+        self.assertEqual(['5', '6'], [p.id for p in a[4:]])
+
     def test_get_or_create(self):
         Person.objects.create(first_name="Granny", last_name="Goose")
         Person.objects.create(first_name="Clark", last_name="Kent")
@@ -742,6 +1330,45 @@ class ListFieldTestCase(RediscoTestCase):
         author1 = Author.objects.get_by_id(1)
         self.assertEqual(2, len(author1.books))
 
+    def test_list_of_models_loaded_in_bulk(self):
+        class Book(models.Model):
+            title = models.CharField(required=True)
+
+        class Author(models.Model):
+            name = models.CharField(required=True)
+            books = models.ListField(Book)
+
+        books = [Book.objects.create(title="Vol. %d" % i) for i in range(5)]
+        Author.objects.create(name="Hugh Young",
+                books=[books[3], books[0], books[4], books[1], books[0]])
+        books[4].delete()
+
+        author = Author.objects.get_by_id(1)
+        self.assertEqual([books[3], books[0], books[1], books[0]],
+                author.books)
+        self.assertEqual("Vol. 3", author.books[0].title)
+        self.assertTrue('_title' in author.books[2].__dict__)
+
+    def test_list_of_models_with_deleted_objects_is_rewritten(self):
+        class Book(models.Model):
+            title = models.CharField(required=True)
+
+        class Author(models.Model):
+            name = models.CharField(required=True)
+            books = models.ListField(Book)
+
+        books = [Book.objects.create(title="Vol. %d" % i) for i in range(4)]
+        Author.objects.create(name="Hugh Young", books=books[:3])
+        books[1].delete()
+
+        author = Author.objects.get_by_id(1)
+        self.assertEqual([books[0], books[2]], author.books)
+        author.books[1] = books[3]
+        assert author.save()
+        self.assertEqual(['1', '4'], self.client.lrange('Author:1:books', 0, -1))
+        self.assertEqual([books[0], books[3]],
+                         Author.objects.get_by_id(1).books)
+
     def test_lazy_reference_field(self):
         class User(models.Model):
             name = models.CharField()
@@ -821,6 +1448,57 @@ class ReferenceFieldTestCase(RediscoTestCase):
         self.assertEqual(p1.department_id, p1.department.id)
         self.assertEqual(p2.department_id, p2.department.id)
 
+    def test_select_related(self):
+        class Word(models.Model):
+            placeholder = models.CharField()
+
+        class Character(models.Model):
+            m = models.CharField()
+            word = models.ReferenceField(Word)
+
+        w1 = Word.objects.create(placeholder="alpha")
+        w2 = Word.objects.create(placeholder="beta")
+        Character.objects.create(m='a', word=w1)
+        Character.objects.create(m='b', word=w2)
+        Character.objects.create(m='c', word=w1)
+        Character.objects.create(m='d')
+
+        chars = list(Character.objects.select_related('word'))
+        for char in chars:
+            self.assertTrue('_word' in char.__dict__)
+        self.assertEqual(w1, chars[0].word)
+        self.assertEqual("beta", chars[1].word.placeholder)
+        self.assertTrue('_placeholder' in chars[1].word.__dict__)
+        self.assertEqual(w1, chars[2].word)
+        self.assertEqual(None, chars[3].word)
+        self.assertRaises(ValueError, Character.objects.select_related, 'm')
+
+    def test_prefetch_related(self):
+        class Post(models.Model):
+            title = models.CharField()
+
+        class Comment(models.Model):
+            body = models.CharField()
+            post = models.ReferenceField(Post, related_name='comments')
+
+        p1 = Post.objects.create(title="First")
+        p2 = Post.objects.create(title="Second")
+        Post.objects.create(title="Third")
+        c1 = Comment.objects.create(body="a", post=p1)
+        c2 = Comment.objects.create(body="b", post=p2)
+        c3 = Comment.objects.create(body="c", post=p1)
+
+        posts = list(Post.objects.prefetch_related('comments'))
+        for post in posts:
+            self.assertTrue('_comments' in post.__dict__)
+        self.assertEqual([c1, c3], list(posts[0].comments))
+        self.assertEqual("b", posts[1].comments[0].body)
+        self.assertTrue(c2 in posts[1].comments)
+        self.assertEqual(0, len(posts[2].comments))
+        self.assertEqual([c3], list(posts[0].comments.filter(body="c")))
+        self.assertRaises(ValueError, Post.objects.prefetch_related,
+                'comment_set')
+
     def test_lazy_reference_field(self):
         class User(models.Model):
             name = models.CharField()
@@ -880,6 +1558,44 @@ class CounterFieldTestCase(RediscoTestCase):
         post = Post.objects.get_by_id(post.id)
         self.assertEqual(1, post.liked)
 
+    def test_index_is_updated_on_save(self):
+        class Post(models.Model):
+            title = models.CharField()
+            liked = models.Counter()
+
+        post = Post.objects.create(title="a")
+        post.incr('liked', 5)
+        post.title = "b"
+        assert post.save()
+        self.assertEqual([post], list(Post.objects.zfilter(liked__gt=3)))
+        self.assertEqual([post], list(Post.objects.filter(liked=5)))
+
+        post.decr('liked', 4)
+        assert post.save()
+        self.assertEqual([], list(Post.objects.zfilter(liked__gt=3)))
+        self.assertEqual([], list(Post.objects.filter(liked=5)))
+        self.assertEqual([post], list(Post.objects.filter(liked=1)))
+
+    def test_update_does_not_read_counters(self):
+        class Post(models.Model):
+            title = models.CharField()
+            liked = models.Counter()
+
+        for i in range(3):
+            Post.objects.create(title="a").incr('liked', i)
+        reads = []
+        get = models.Counter.__get__
+        def counting_get(counter, instance, owner):
+            reads.append(instance)
+            return get(counter, instance, owner)
+        models.Counter.__get__ = counting_get
+        try:
+            self.assertEqual(3, Post.objects.update(title="b"))
+        finally:
+            models.Counter.__get__ = get
+        self.assertEqual([], reads)
+        self.assertEqual(3, Post.objects.zfilter(liked__gte=0).count())
+
 
 class MutexTestCase(RediscoTestCase):
 
@@ -913,3 +1629,139 @@ class MutexTestCase(RediscoTestCase):
         Mutex(self.p1).lock()
         with Mutex(self.p2):
             self.assert_(True)
+
+    def test_unlock_keeps_lock_of_other_holder(self):
+        m1 = Mutex(self.p1, timeout=100)
+        m1.lock()
+        m2 = Mutex(self.p2)
+        m2.lock()
+        m1.unlock()
+        self.assertEqual(m2.token, self.client.get('Person:1:_lock'))
+        m2.unlock()
+        self.assertFalse(self.client.exists('Person:1:_lock'))
+
+    def test_blocking_lock_wakes_on_unlock(self):
+        times = {}
+
+        def f(person):
+            with Mutex(person, blocking=True):
+                times['locked'] = time.time()
+
+        m = Mutex(self.p1, timeout=5000)
+        m.lock()
+        t = Thread(target=f, args=(self.p2,))
+        t.start()
+        time.sleep(0.1)
+        released = time.time()
+        m.unlock()
+        t.join()
+        self.assert_(times['locked'] - released < 0.5)
+
+    def test_unlock_without_waiters_leaves_no_keys(self):
+        with Mutex(self.p1, blocking=True):
+            pass
+        self.assertFalse(self.client.exists('Person:1:_lock'))
+        self.assertFalse(self.client.exists('Person:1:_unlocked'))
+
+    def test_unknown_lock_option(self):
+        self.assertRaises(ValueError, Mutex, self.p1, timout=10)
+        self.assertRaises(ValueError, Mutex, self.p1, lock=1)
+        self.assertRaises(ValueError, Mutex, self.p1, key="other")
+
+
+class SessionTestCase(RediscoTestCase):
+
+    def test_identity_map(self):
+        class Book(models.Model):
+            title = models.CharField()
+
+        class Author(models.Model):
+            name = models.CharField()
+            favorite = models.ReferenceField(Book)
+            books = models.ListField(Book)
+
+        book = Book.objects.create(title="Wizard's First Rule")
+        Author.objects.create(name="Terry Goodkind", favorite=book,
+                books=[book])
+
+        with redisco.session() as session:
+            b = Book.objects.get_by_id(book.id)
+            self.assertTrue(b is Book.objects.get_by_id(book.id))
+            self.assertTrue(b is Book.objects.all()[0])
+            author = Author.objects.all()[0]
+            self.assertTrue(b is author.favorite)
+            self.assertTrue(b is author.books[0])
+            self.assertTrue(author is Author.objects.get_by_id(1))
+            self.assertTrue(b.key() in session)
+
+            b.delete()
+            self.assertFalse(b.key() in session)
+            self.assertEqual(None, Book.objects.get_by_id(book.id))
+
+            new = Book.objects.create(title="Stone of Tears")
+            self.assertTrue(new is Book.objects.get_by_id(new.id))
+
+        self.assertEqual(None, redisco.get_session())
+        a1 = Author.objects.get_by_id(1)
+        self.assertFalse(a1 is Author.objects.get_by_id(1))
+
+
+class HashCacheTestCase(RediscoTestCase):
+
+    def setUp(self):
+        super(HashCacheTestCase, self).setUp()
+        self.cache = models.HashCache(size=2, ttl=60)
+
+        class Country(models.Model):
+            name = models.CharField()
+
+            class Meta:
+                cache = self.cache
+
+        self.Country = Country
+
+    def test_get_by_id(self):
+        ph = self.Country.objects.create(name="Philippines")
+        self.assertEqual("Philippines",
+                self.Country.objects.get_by_id(ph.id).name)
+        self.assertEqual((0, 1), (self.cache.hits, self.cache.misses))
+        self.assertEqual("Philippines",
+                self.Country.objects.get_by_id(ph.id).name)
+        self.assertEqual((1, 1), (self.cache.hits, self.cache.misses))
+
+        ph.name = "Republic of the Philippines"
+        assert ph.save()
+        self.assertEqual(0, len(self.cache))
+        self.assertEqual("Republic of the Philippines",
+                self.Country.objects.get_by_id(ph.id).name)
+
+        ph.delete()
+        self.assertEqual(None, self.Country.objects.get_by_id(ph.id))
+
+    def test_lru_and_ttl(self):
+        for name in ("Japan", "Korea", "China"):
+            self.Country.objects.create(name=name)
+        list(self.Country.objects.all())
+        self.assertEqual(2, len(self.cache))
+        self.assertEqual(None, self.cache.get(self.Country._key['1']))
+        self.assertEqual({'name': 'China'},
+                self.cache.get(self.Country._key['3']))
+
+        self.cache.ttl = -1
+        self.cache.set(self.Country._key['3'], {'name': 'China'})
+        self.assertEqual(None, self.cache.get(self.Country._key['3']))
+
+    def test_attribute_reads_use_cache(self):
+        jp = self.Country.objects.create(name="Japan")
+        self.cache.set(jp.key(), {'name': 'Nippon'})
+        country = self.Country.objects.get_by_id(jp.id)
+        del country._name
+        self.assertEqual("Nippon", country.name)
+
+    def test_invalidation_from_other_processes(self):
+        self.cache.listen()
+        time.sleep(0.1)
+        self.cache.set('Country:1', {'name': 'Japan'})
+        self.client.publish(self.cache.channel, 'Country:1')
+        time.sleep(0.1)
+        self.assertEqual(0, len(self.cache))